@@ -1,8 +1,160 @@
-from flask import Flask, render_template, request, jsonify
-from llm_client import generate_reply
+import hashlib
+import hmac
+import os
+import time
+import uuid
+
+from flask import Flask, Response, g, render_template, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import request_profiler
+
+from chat_codec import (
+    MAX_BODY_BYTES,
+    MAX_SESSION_ID_CHARS,
+    ChatPayloadError,
+    decode_chat_request,
+    decode_compare_request,
+    dumps,
+    valid_request_id,
+)
+from job_queue import JOB_MAX_WAIT_S, JobQueue, JobQueueFull
+from llm_client import (
+    build_fallback_reply,
+    canonical_mode,
+    generate_replies_concurrently,
+    generate_reply,
+    generate_reply_detailed,
+    get_upstream_stats,
+    is_fallback_reply,
+)
+from prompt_variants import assign_variant
+from reply_buffer import ReplyBuffer, ReplyBufferConflict
+from upstream_guard import Deadline
+
+
+# 背景 job 不受 HTTP timeout 限制，可以給上游較長的時間預算
+JOB_DEADLINE_S = float(os.getenv("JOB_DEADLINE_S", "90"))
+
+# /api/compare 一次打多個 mode，只給臨床端用：請求要帶 X-Compare-Token；沒設 token 時整個關閉
+COMPARE_ADMIN_TOKEN = os.getenv("COMPARE_ADMIN_TOKEN", "")
+COMPARE_HEADER = "X-Compare-Token"
+
+
+def _json_response(obj, status: int = 200) -> Response:
+    return Response(dumps(obj), status=status, mimetype="application/json")
+
+
+# 依 (session_id, request_id) 暫存回覆（本機 SQLite，所有 worker 共用）
+reply_buffer = ReplyBuffer()
+
+# 斷線重連讀暫存回覆時，用這個標頭帶 session_id（不放網址，避免進 access log）
+SESSION_HEADER = "X-Session-ID"
+
+
+def _compare_allowed(token) -> bool:
+    if not COMPARE_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, COMPARE_ADMIN_TOKEN)
+
+
+def _fingerprint(mode: str, messages: list) -> str:
+    return hashlib.sha256(dumps([mode, messages])).hexdigest()
+
+
+def _generate_buffered(chat_request, deadline: Deadline, owned: bool = False) -> str:
+    """
+    有 session_id + request_id 時經過 reply_buffer：
+    - 同一個 request_id 正在生成 / 已完成 → 等它或直接拿，不再呼叫上游
+    - 自己是第一個 → 生成後存起來；fallback / 錯誤不存，讓重送能真的再試
+    - 同一個 request_id 換了內容 → ReplyBufferConflict（由呼叫端轉成 409）
+    - owned=True：呼叫端已 claim 過（job 送出時），直接生成
+    """
+    mode, messages, session_id, request_id = chat_request
+    if request_id is None or session_id is None:
+        return generate_reply(mode=mode, messages=messages, deadline=deadline, session_id=session_id)
+
+    key = (session_id, request_id)
+    fingerprint = _fingerprint(mode, messages)
+    while not owned:
+        owned, _ = reply_buffer.claim(key, fingerprint)
+        if owned:
+            break
+        buffered = reply_buffer.wait(key, timeout=deadline.remaining())
+        if buffered is not None and buffered["status"] == "done":
+            return buffered["text"]
+        if buffered is not None or deadline.expired():
+            # 原本那次還在生成，只是超過了這次請求的時間預算
+            return build_fallback_reply(mode)
+        # 原本那次已放棄（失敗 / 被淘汰）：再搶一次，只有搶到的那個去生成，其他人繼續等
+
+    try:
+        reply = generate_reply(mode=mode, messages=messages, deadline=deadline, session_id=session_id)
+    except Exception:
+        reply_buffer.abandon(key)
+        raise
+
+    if is_fallback_reply(reply):
+        reply_buffer.abandon(key)
+    else:
+        reply_buffer.finish(key, reply)
+    return reply
+
+
+def _handoff_profile():
+    """
+    cProfile 只看得到請求 thread：把這裡的 profiler 停掉（不存、名額不放），
+    回傳 Handoff 讓真正做事的 thread 用 request_profiler.profiled(handoff=...) 接手
+    """
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return None
+    return request_profiler.handoff(profiler, g.request_id)
+
+
+def _run_chat_job(payload) -> dict:
+    chat_request, owned, handoff = payload
+    try:
+        with request_profiler.profiled(handoff=handoff):
+            reply = _generate_buffered(chat_request, Deadline(JOB_DEADLINE_S), owned=owned)
+    finally:
+        if handoff is not None:
+            handoff.release()
+    variant = assign_variant(canonical_mode(chat_request.mode), chat_request.session_id)
+    return {"reply": reply, "variant": variant.id}
+
 
 def create_app():
     app = Flask(__name__)
+    # werkzeug 讀 body 時就會檢查，超過直接 413（含 chunked 上傳）
+    app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
+
+    jobs = JobQueue(handler=_run_chat_job)
+
+    @app.before_request
+    def assign_request_id():
+        # 沿用 proxy 給的 X-Request-ID，否則自己產生
+        rid = request.headers.get("X-Request-ID", "")
+        g.request_id = rid if valid_request_id(rid) else uuid.uuid4().hex
+
+        g.profiler = None
+        if request_profiler.is_enabled() and request_profiler.should_profile(
+            request.headers.get(request_profiler.PROFILE_HEADER)
+        ):
+            g.profiler = request_profiler.start()
+
+    @app.after_request
+    def finish_request(response):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            if request_profiler.stop_and_save(profiler, g.request_id):
+                response.headers["X-Profile-Id"] = g.request_id
+        response.headers["X-Request-ID"] = g.request_id
+        return response
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def too_large(e):
+        return _json_response({"error": "request body too large"}, status=413)
 
     @app.route("/")
     def index():
@@ -10,14 +162,196 @@ def create_app():
 
     @app.route("/api/chat", methods=["POST"])
     def chat():
-        data = request.get_json(force=True)
-        mode = data.get("mode", "support")
-        messages = data.get("messages", [])
+        # 請求一進來就開始計時，整條路徑共用同一個 deadline
+        deadline = Deadline()
+
+        # 有 Content-Length 就在讀 body 前先擋
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return _json_response({"error": "request body too large"}, status=413)
+
+        try:
+            chat_request = decode_chat_request(request.get_data(cache=False))
+        except ChatPayloadError as e:
+            return _json_response({"error": str(e)}, status=e.status)
 
         # 呼叫你封裝好的 LLM
-        reply = generate_reply(mode=mode, messages=messages)
+        try:
+            reply = _generate_buffered(chat_request, deadline)
+        except ReplyBufferConflict as e:
+            return _json_response({"error": str(e)}, status=409)
+        variant = assign_variant(canonical_mode(chat_request.mode), chat_request.session_id)
+
+        return _json_response({"reply": reply, "variant": variant.id})
+
+    @app.route("/api/chat/jobs", methods=["POST"])
+    def submit_chat_job():
+        # 非同步版本：立刻回 job_id，由背景 worker 呼叫上游
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return _json_response({"error": "request body too large"}, status=413)
+
+        try:
+            chat_request = decode_chat_request(request.get_data(cache=False))
+        except ChatPayloadError as e:
+            return _json_response({"error": str(e)}, status=e.status)
+
+        # 同一個 request_id 重送（重新整理 / 重連，可能落在別的 worker）：
+        # 已有 job 就回原本的 job_id；自己是第一個就先 claim，job 直接生成
+        key = None
+        owned = False
+        if chat_request.session_id is not None and chat_request.request_id is not None:
+            key = (chat_request.session_id, chat_request.request_id)
+            try:
+                owned, existing_job_id = reply_buffer.claim(
+                    key, _fingerprint(chat_request.mode, chat_request.messages)
+                )
+            except ReplyBufferConflict as e:
+                return _json_response({"error": str(e)}, status=409)
+            existing = jobs.get(existing_job_id) if existing_job_id else None
+            if existing is not None:
+                return _json_response({"job_id": existing_job_id, "status": existing["status"]}, status=202)
+
+        # 被抽中 profile 時改在 job worker 裡 profile（job 結束後才拿得到）
+        handoff = _handoff_profile()
+        try:
+            job_id = jobs.submit((chat_request, owned, handoff))
+        except BaseException as e:
+            if handoff is not None:
+                handoff.release()
+            if owned:
+                reply_buffer.abandon(key)
+            if not isinstance(e, JobQueueFull):
+                raise
+            resp = _json_response({"error": "server busy, try again later"}, status=503)
+            resp.headers["Retry-After"] = "5"
+            return resp
+        if owned:
+            reply_buffer.attach_job(key, job_id)
+
+        resp = _json_response({"job_id": job_id, "status": "queued"}, status=202)
+        if handoff is not None:
+            resp.headers["X-Profile-Id"] = handoff.request_id
+        return resp
+
+    @app.route("/api/chat/jobs/<job_id>", methods=["GET"])
+    def get_chat_job(job_id):
+        # long-poll：?wait=秒數（上限 JOB_MAX_WAIT_S），job 結束就立刻回
+        try:
+            wait = float(request.args.get("wait", "0"))
+        except ValueError:
+            wait = 0.0
+
+        job = jobs.wait(job_id, timeout=min(wait, JOB_MAX_WAIT_S)) if wait > 0 else jobs.get(job_id)
+        if job is None:
+            return _json_response({"error": "job not found or expired"}, status=404)
+        return _json_response(job)
+
+    @app.route("/api/chat/replies/<request_id>", methods=["GET"])
+    def get_buffered_reply(request_id):
+        # 斷線重連：?offset=已收到的字元數，?wait=秒數（生成中時 long-poll）
+        # 必須帶原本的 session_id（X-Session-ID 標頭）；對不上一律當作不存在
+        try:
+            offset = int(request.args.get("offset", "0"))
+            wait = float(request.args.get("wait", "0"))
+        except ValueError:
+            return _json_response({"error": "offset/wait must be numbers"}, status=400)
+
+        session_id = request.headers.get(SESSION_HEADER, "").strip()[:MAX_SESSION_ID_CHARS]
+        if not session_id:
+            return _json_response({"error": "reply not found or expired"}, status=404)
+
+        key = (session_id, request_id)
+        if wait > 0:
+            reply_buffer.wait(key, timeout=min(wait, JOB_MAX_WAIT_S))
+        buffered = reply_buffer.read(key, offset=offset)
+        if buffered is None:
+            return _json_response({"error": "reply not found or expired"}, status=404)
+        return _json_response(buffered)
+
+    @app.route("/api/compare", methods=["POST"])
+    def compare_modes():
+        # 同一段對話同時用多個 mode 生成（給臨床端並排比較）
+        # ?stream=1：每完成一個 mode 就送出一行 NDJSON；否則全部完成後一次回
+        # 每次呼叫花 N 倍的上游費用：只有持有 COMPARE_ADMIN_TOKEN 的人可以用
+        if not _compare_allowed(request.headers.get(COMPARE_HEADER)):
+            return _json_response({"error": "forbidden"}, status=403)
+
+        deadline = Deadline()
+        started = time.perf_counter()
+
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return _json_response({"error": "request body too large"}, status=413)
+
+        try:
+            modes, chat_request = decode_compare_request(request.get_data(cache=False))
+        except ChatPayloadError as e:
+            return _json_response({"error": str(e)}, status=e.status)
+
+        handoff = _handoff_profile()
+        if handoff is not None:
+            # 被抽中 profile 時各 mode 改在這個 thread 依序生成，cProfile 才看得到 generate_reply
+            # （這次回應的延遲不代表平常的並行表現）
+            def profiled_results():
+                with request_profiler.profiled(handoff=handoff):
+                    for mode in modes:
+                        yield generate_reply_detailed(
+                            mode,
+                            chat_request.messages,
+                            deadline=deadline,
+                            session_id=chat_request.session_id,
+                            source="compare",
+                        )
+
+            results = profiled_results()
+        else:
+            results = generate_replies_concurrently(
+                modes, chat_request.messages, deadline=deadline, session_id=chat_request.session_id
+            )
+
+        if request.args.get("stream") in ("1", "true"):
+            def ndjson():
+                for result in results:
+                    yield dumps(result) + b"\n"
+
+            resp = Response(ndjson(), mimetype="application/x-ndjson")
+        else:
+            replies = {r["mode"]: r for r in results}
+            resp = _json_response({
+                "results": [replies[m] for m in modes],
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+        if handoff is not None:
+            # 串流在開始前就斷線時 generator 不會執行：回應關閉時歸還名額（已接手則不做事）
+            resp.call_on_close(handoff.release)
+            resp.headers["X-Profile-Id"] = handoff.request_id
+        return resp
+
+    @app.route("/api/upstream/status", methods=["GET"])
+    def upstream_status():
+        # 監控用：斷路器狀態與重試計數
+        stats = get_upstream_stats()
+        stats["jobs"] = jobs.stats()
+        stats["reply_buffer"] = reply_buffer.stats()
+        return jsonify(stats)
+
+    @app.route("/api/profiles/<request_id>", methods=["GET"])
+    def get_profile(request_id):
+        # 只有持有 PROFILE_ADMIN_TOKEN 的人可以取回 profile
+        if not request_profiler.is_admin(request.headers.get(request_profiler.PROFILE_HEADER)):
+            return _json_response({"error": "forbidden"}, status=403)
+
+        if request.args.get("format") == "raw":
+            raw = request_profiler.load_raw(request_id)
+            if raw is None:
+                return _json_response({"error": "profile not found"}, status=404)
+            return Response(raw, mimetype="application/octet-stream")
 
-        return jsonify({"reply": reply})
+        sort = request.args.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "calls"):
+            sort = "cumulative"
+        text = request_profiler.render_text(request_id, sort=sort)
+        if text is None:
+            return _json_response({"error": "profile not found"}, status=404)
+        return Response(text, mimetype="text/plain")
 
     return app
 
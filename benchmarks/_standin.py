@@ -0,0 +1,74 @@
+# benchmarks/_standin.py
+"""
+benchmarks 共用的本機 OpenAI 相容 stand-in（只用標準庫，不需要網路 / API Key）
+
+- OK_BODY / MODELS_BODY / ERROR_BODY：Responses API 成功回應、/models 列表、錯誤回應
+- start_standin(respond)：起一個背景 HTTP server；每個請求呼叫 respond(method, path)，
+  回傳 (status, body, extra_headers)
+"""
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Tuple
+
+Response = Tuple[int, bytes, Dict[str, str]]
+
+OK_BODY = json.dumps({
+    "id": "resp_standin",
+    "object": "response",
+    "created_at": 0,
+    "model": "standin",
+    "status": "completed",
+    "output": [{
+        "type": "message",
+        "id": "msg_standin",
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": "好的，我在這裡。", "annotations": []}],
+    }],
+    "usage": {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+}).encode("utf-8")
+
+MODELS_BODY = json.dumps(
+    {"object": "list", "data": [{"id": "standin", "object": "model", "created": 0, "owned_by": "standin"}]}
+).encode("utf-8")
+
+
+def error_body(message: str, type_: str = "server_error", code: str | None = None) -> bytes:
+    return json.dumps({"error": {"message": message, "type": type_, "code": code}}).encode("utf-8")
+
+
+ERROR_BODY = error_body("standin failure")
+
+
+def start_standin(respond: Callable[[str, str], Response]) -> ThreadingHTTPServer:
+    """回傳已在背景執行的 server；base_url 為 http://127.0.0.1:{server.server_address[1]}/v1"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _handle(self, method: str) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            status, body, headers = respond(method, self.path)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,81 @@
+# benchmarks/bench_chat_codec.py
+"""
+/api/chat 請求解碼基準測試（不需要網路 / API Key）
+
+比較：
+- baseline：json.loads + 原本的逐則 str() 正規化
+- codec：chat_codec.decode_chat_request（orjson + 上限 + 提早截斷）
+
+用法：python benchmarks/bench_chat_codec.py
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_codec import ChatPayloadError, decode_chat_request  # noqa: E402
+
+
+def _turns(n: int, text: str) -> list:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{text} #{i}"}
+        for i in range(n)
+    ]
+
+
+PAYLOADS = {
+    "typical_20_turns": {"mode": "cbt", "messages": _turns(20, "今天在公司被主管唸了一頓，心裡很悶")},
+    "long_500_turns": {"mode": "cbt", "messages": _turns(500, "我好像一直在重複同樣的關係模式")},
+    "long_5000_turns": {"mode": "analytic", "messages": _turns(5000, "我好像一直在重複同樣的關係模式")},
+    "huge_single_content": {"mode": "support", "messages": [{"role": "user", "content": "累" * 200_000}]},
+    "odd_types": {
+        "mode": "support",
+        "messages": [
+            {"role": "user", "content": {"nested": list(range(50))}},
+            {"role": 3, "content": [1, 2, 3]},
+            "not-a-dict",
+            {"role": "system", "content": 12345},
+        ]
+        * 500,
+    },
+}
+
+
+def _baseline(raw: bytes):
+    data = json.loads(raw)
+    out = []
+    for m in data.get("messages", []):
+        if not isinstance(m, dict):
+            continue
+        content = m.get("content", "")
+        if not isinstance(content, str):
+            content = str(content)
+        content = content.strip()
+        if content:
+            out.append({"role": m.get("role") or "user", "content": content})
+    return data.get("mode"), out
+
+
+def _codec(raw: bytes):
+    try:
+        return decode_chat_request(raw)
+    except ChatPayloadError as e:
+        return e.status
+
+
+def main() -> None:
+    print(f"{'payload':<22}{'bytes':>10}{'baseline ms':>14}{'codec ms':>12}{'speedup':>10}")
+    for name, payload in PAYLOADS.items():
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        number = max(1, 2000 // max(1, len(raw) // 4096))
+        base = min(timeit.repeat(lambda: _baseline(raw), number=number, repeat=5)) / number
+        fast = min(timeit.repeat(lambda: _codec(raw), number=number, repeat=5)) / number
+        print(f"{name:<22}{len(raw):>10}{base * 1e3:>14.3f}{fast * 1e3:>12.3f}{base / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
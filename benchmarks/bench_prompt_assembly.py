@@ -0,0 +1,185 @@
+# benchmarks/bench_prompt_assembly.py
+"""
+Prompt 組裝 / 訊息正規化微基準（純 Python 熱路徑，不需要網路 / API Key）
+
+涵蓋：
+- build_mode_instruction（所有 mode 別名）
+- analytic_mode._route_submode / build_analytic_prompt
+- _build_openai_messages：10 ~ 5000 回合、混合 role 與非字串 content
+
+用法：
+  python benchmarks/bench_prompt_assembly.py                  # 跑並與 baseline 比較
+  python benchmarks/bench_prompt_assembly.py --save-baseline  # 更新 baseline
+  python benchmarks/bench_prompt_assembly.py -k openai_messages --threshold 1.3
+
+計時方式：每項取多輪的中位數，再除以同一次執行裡量到的「參考工作量」（固定的純 Python 排序）。
+baseline 只存這個相對值，不存絕對時間，所以換機器 / 機器忙碌時仍可比較。
+任何一項的相對值比 baseline 高超過 threshold 倍（重量一次後仍超過）就以 exit code 1 結束（可接 CI）。
+同一台機器、未改程式時各項比值約在 0.5x ~ 1.6x 之間浮動，所以預設門檻 2x：
+抓的是數量級的退化（例如多一層迴圈），不是 10% 的差異。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# llm_client 載入時需要 key、會建立限流器 SQLite；這裡都導到暫存區，不打網路
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+_TMP = tempfile.mkdtemp(prefix="bench-prompt-")
+os.environ.setdefault("RATE_GOVERNOR_DB_PATH", os.path.join(_TMP, "governor.sqlite3"))
+os.environ.setdefault("USAGE_DB_PATH", os.path.join(_TMP, "usage.sqlite3"))
+
+import analytic_mode  # noqa: E402
+import llm_client  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "prompt_assembly.json")
+
+MODES = ["cbt", "support", "supportive", "default", "analytic", "psychodynamic", "分析性", "unknown"]
+HISTORY_SIZES = [10, 100, 1000, 5000]
+
+BASELINE_FORMAT = 2
+
+_USER_LINES = [
+    "昨晚又夢到被追，醒來心跳很快",
+    "我知道道理，可是就是做不到",
+    "主管今天當眾念我，我覺得自己很沒用",
+    "我想改善跟媽媽的關係模式",
+    "你會不會覺得我很煩",
+]
+
+
+def make_history(n: int) -> List[dict]:
+    """混合 role（含非法 role / 缺 role）與非字串 content（數字、list、None、空白）"""
+    out: List[dict] = []
+    for i in range(n):
+        k = i % 10
+        if k == 7:
+            out.append({"role": "system", "content": 12345})
+        elif k == 8:
+            out.append({"content": ["list", "content", i]})
+        elif k == 9:
+            out.append({"role": "assistant", "content": "   "})
+        elif i % 2 == 0:
+            out.append({"role": "user", "content": _USER_LINES[i % len(_USER_LINES)] + f" ({i})"})
+        else:
+            out.append({"role": "assistant", "content": f"聽起來那一刻真的很不好受。可以多說一點嗎？({i})"})
+    # 最後一則固定是 user，讓分析性 routing 有東西看
+    out.append({"role": "user", "content": _USER_LINES[n % len(_USER_LINES)]})
+    return out
+
+
+def build_cases() -> List[Tuple[str, Callable[[], object]]]:
+    cases: List[Tuple[str, Callable[[], object]]] = []
+    short = make_history(10)
+
+    for mode in MODES:
+        cases.append((f"mode_instruction[{mode}]", lambda m=mode: llm_client.build_mode_instruction(m, short)))
+
+    for i, text in enumerate(_USER_LINES + ["今天天氣很好"]):
+        cases.append((f"route_submode[{i}]", lambda t=text: analytic_mode._route_submode(t)))
+
+    for n in HISTORY_SIZES:
+        hist = make_history(n)
+        cases.append((f"analytic_prompt[{n}]", lambda h=hist: analytic_mode.build_analytic_prompt(messages=h)))
+        for mode in ("cbt", "support", "analytic"):
+            cases.append(
+                (f"openai_messages[{mode},{n}]", lambda m=mode, h=hist: llm_client._build_openai_messages(m, h))
+            )
+    return cases
+
+
+_REFERENCE_DATA = [((i * 7919) % 1009, str(i)) for i in range(2000)]
+
+
+def reference_workload() -> object:
+    """固定的純 Python 工作量；只當同一次執行內的量尺，與 repo 程式碼無關"""
+    return sorted(_REFERENCE_DATA)
+
+
+def measure(fn: Callable[[], object], min_time: float = 0.05, repeat: int = 15) -> float:
+    """回傳單次呼叫秒數的中位數（先自動決定 number，讓每輪至少 min_time）"""
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return statistics.median(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != BASELINE_FORMAT:
+        print(f"baseline {path} is in an old format (absolute timings); run --save-baseline")
+        return {}
+    return data["relative"]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=2.0, help="相對值高於 baseline 幾倍算退化")
+    parser.add_argument("-k", default="", help="只跑名稱包含此字串的項目")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    cases = {name: fn for name, fn in build_cases() if not args.k or args.k in name}
+
+    # 量尺前後各量一次取平均，抵銷執行中途的機器負載變化
+    ref_before = measure(reference_workload)
+    timings = {name: measure(fn) for name, fn in cases.items()}
+    ref = (ref_before + measure(reference_workload)) / 2
+    print(f"reference workload: {ref * 1e6:.2f} us/call")
+
+    results: Dict[str, float] = {}
+    regressions: List[str] = []
+    print(f"{'case':<36}{'us/call':>12}{'x ref':>10}{'baseline':>10}{'ratio':>8}")
+    for name, t in timings.items():
+        rel = t / ref
+        base = baseline.get(name)
+        if base and not args.save_baseline and rel / base > args.threshold:
+            # 超過門檻先連同量尺重量一次，取較低的那次，避免單次雜訊誤報
+            t2 = measure(cases[name])
+            rel = min(rel, t2 / measure(reference_workload))
+            t = min(t, t2)
+        results[name] = rel
+        ratio = rel / base if base else None
+        flag = ""
+        if ratio is not None and ratio > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:<36}{t * 1e6:>12.2f}{rel:>10.4f}"
+            f"{(base if base else float('nan')):>10.4f}"
+            f"{(ratio if ratio is not None else float('nan')):>8.2f}{flag}"
+        )
+
+    if args.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {"format": BASELINE_FORMAT, "reference": "sorted(2000 tuples)", "relative": baseline},
+                f, ensure_ascii=False, indent=2, sort_keys=True,
+            )
+        print(f"baseline saved → {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold}x: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# benchmarks/effects_frametime.py
+"""
+背景動畫（櫻花 / 星星）frame time 比較：舊版（每片花瓣一個帶 filter 的 SVG div）vs 目前版本
+
+- 從 git 取出兩個版本的 templates/index.html + static/，各自用本機 HTTP server 提供
+  （--old / --new 給 git revision；WORKTREE 代表目前工作目錄）
+- 用 Playwright 開 headless Chromium，透過 CDP Emulation.setCPUThrottlingRate 模擬慢 CPU
+- 頁面載入、暖機後用 requestAnimationFrame 記錄 MEASURE_S 秒的 frame 間隔：
+  平均、p95、超過 33ms 的長 frame 數；另外記錄背景容器裡的節點數
+- 外部資源（Google Fonts 等）一律擋掉，量測不受網路影響
+
+用法：
+  pip install playwright && playwright install chromium
+  python benchmarks/effects_frametime.py [--old REV] [--new REV] [--rates 1,4,6] [--runs 3]
+預設 --old 是第一次加入 static/effects.js 之前的版本，--new 是 WORKTREE
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WARMUP_S = 3
+MEASURE_S = 5
+VIEWPORT = {"width": 1280, "height": 800}
+
+# 頁面內量測：rAF 間隔（ms）
+_MEASURE_JS = """
+(ms) => new Promise((resolve) => {
+  const deltas = [];
+  let last = null;
+  const end = performance.now() + ms;
+  const tick = (now) => {
+    if (last !== null) deltas.push(now - last);
+    last = now;
+    if (now < end) requestAnimationFrame(tick);
+    else resolve({
+      deltas,
+      nodes: document.querySelectorAll('.sakura-container *, .star-container *').length,
+    });
+  };
+  requestAnimationFrame(tick);
+})
+"""
+
+
+def _git(*args: str) -> bytes:
+    return subprocess.run(["git", *args], cwd=ROOT, check=True, capture_output=True).stdout
+
+
+def _default_old_rev() -> str:
+    added = _git("log", "--diff-filter=A", "--format=%H", "--", "static/effects.js").decode().split()
+    if not added:
+        sys.exit("cannot find the commit that added static/effects.js; pass --old")
+    return f"{added[-1]}^"
+
+
+def _export(rev: str, dest: str) -> None:
+    """把 rev 的 templates/index.html 與 static/ 放到 dest（url_for 換成靜態路徑）"""
+    os.makedirs(os.path.join(dest, "static"))
+    if rev == "WORKTREE":
+        shutil.copytree(os.path.join(ROOT, "static"), os.path.join(dest, "static"), dirs_exist_ok=True)
+        with open(os.path.join(ROOT, "templates", "index.html"), encoding="utf-8") as f:
+            html = f.read()
+    else:
+        for path in _git("ls-tree", "-r", "--name-only", rev, "static/").decode().split():
+            with open(os.path.join(dest, path), "wb") as f:
+                f.write(_git("show", f"{rev}:{path}"))
+        html = _git("show", f"{rev}:templates/index.html").decode("utf-8")
+    html = re.sub(r"\{\{\s*url_for\('static',\s*filename='([^']+)'\)\s*\}\}", r"/static/\1", html)
+    with open(os.path.join(dest, "index.html"), "w", encoding="utf-8") as f:
+        f.write(html)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _serve(directory: str) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _measure(browser, url: str, rate: float, theme: str) -> dict:
+    context = browser.new_context(viewport=VIEWPORT, reduced_motion="no-preference")
+    # 主題存在 localStorage（script.js 載入時讀）
+    context.add_init_script(f"localStorage.setItem('theme', '{theme}');")
+    page = context.new_page()
+    origin = url.rstrip("/")
+    page.route("**/*", lambda route: route.continue_() if route.request.url.startswith(origin) else route.abort())
+
+    cdp = context.new_cdp_session(page)
+    cdp.send("Emulation.setCPUThrottlingRate", {"rate": rate})
+
+    page.goto(url, wait_until="load")
+    page.wait_for_timeout(WARMUP_S * 1000)
+    sample = page.evaluate(_MEASURE_JS, MEASURE_S * 1000)
+    engine = page.evaluate("window.effectsEngine ? window.effectsEngine.stats() : null")
+    context.close()
+
+    deltas = sorted(sample["deltas"])
+    return {
+        "mean": statistics.fmean(deltas),
+        "p95": deltas[int(len(deltas) * 0.95) - 1],
+        "long": sum(1 for d in deltas if d > 33.4),
+        "frames": len(deltas),
+        "nodes": sample["nodes"],
+        "engine": engine,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--old", default=None, help="git revision of the baseline (default: before effects.js)")
+    parser.add_argument("--new", default="WORKTREE", help="git revision to compare (default: working tree)")
+    parser.add_argument("--rates", default="1,4,6", help="CPU throttling rates, comma separated")
+    parser.add_argument("--runs", type=int, default=3, help="runs per version and rate (median is reported)")
+    parser.add_argument("--theme", default="light", choices=("light", "dark"), help="light = petals, dark = stars")
+    args = parser.parse_args()
+
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        print("playwright is not installed: pip install playwright && playwright install chromium")
+        return 2
+
+    versions = {"old": args.old or _default_old_rev(), "new": args.new}
+    rates = [float(r) for r in args.rates.split(",")]
+
+    tmp = tempfile.mkdtemp()
+    servers = {}
+    for label, rev in versions.items():
+        _export(rev, os.path.join(tmp, label))
+        servers[label] = _serve(os.path.join(tmp, label))
+
+    print(f"old={versions['old']}  new={versions['new']}  theme={args.theme}  "
+          f"warmup={WARMUP_S}s  measure={MEASURE_S}s  runs={args.runs}")
+    print(f"{'cpu':>4} {'version':<8} {'mean ms':>8} {'p95 ms':>8} {'>33ms':>6} {'nodes':>6}  engine")
+    try:
+        with sync_playwright() as pw:
+            browser = pw.chromium.launch()
+            for rate in rates:
+                for label, server in servers.items():
+                    url = f"http://127.0.0.1:{server.server_address[1]}/index.html"
+                    runs = [_measure(browser, url, rate, args.theme) for _ in range(args.runs)]
+                    runs.sort(key=lambda r: r["mean"])
+                    mid = runs[len(runs) // 2]
+                    engine = mid["engine"]
+                    engine_note = (
+                        f"lite={engine['lite']} petals={engine['petals']} stars={engine['stars']}" if engine else "-"
+                    )
+                    print(
+                        f"{rate:>3.0f}x {label:<8} {mid['mean']:>8.1f} {mid['p95']:>8.1f} "
+                        f"{mid['long']:>6} {mid['nodes']:>6}  {engine_note}"
+                    )
+            browser.close()
+    finally:
+        for server in servers.values():
+            server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# benchmarks/governor_429_standin.py
+"""
+跨 process 限流器驗證：本機起一個會回 429 的 OpenAI 相容 stand-in
+
+- stand-in：60 秒滑動窗內最多 STANDIN_RPM 個請求，超過回 429（附 x-ratelimit-* 標頭）
+- 開 WORKERS 個 process（模擬 gunicorn workers）各自呼叫 generate_reply
+- 分別跑「關閉限流器」與「開啟限流器」兩輪，比較上游收到的 429 數量
+- 檢查：開啟限流器後的 429 要明顯少於關閉時（不超過 MAX_GOVERNED_429_RATIO 倍），否則 exit code 1
+
+用法：python benchmarks/governor_429_standin.py（不需要網路 / API Key）
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+from _standin import ERROR_BODY, OK_BODY, error_body, start_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STANDIN_RPM = 20
+WORKERS = 4
+CALLS_PER_WORKER = 8
+
+# 開啟限流器後允許的 429 數量上限（相對於關閉時）
+MAX_GOVERNED_429_RATIO = 0.25
+
+
+def make_standin(rpm: int):
+    hits: deque = deque()
+    lock = threading.Lock()
+    counts = {"ok": 0, "429": 0}
+
+    def respond(method: str, path: str):
+        if method != "POST":
+            return 404, ERROR_BODY, {}
+        with lock:
+            now = time.time()
+            while hits and hits[0] < now - 60:
+                hits.popleft()
+            allowed = len(hits) < rpm
+            if allowed:
+                hits.append(now)
+                counts["ok"] += 1
+            else:
+                counts["429"] += 1
+            remaining = max(0, rpm - len(hits))
+            reset = (hits[0] + 60 - now) if hits else 0.0
+
+        headers = {
+            "x-ratelimit-limit-requests": str(rpm),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+        if allowed:
+            return 200, OK_BODY, headers
+        return 429, error_body("Rate limit reached", "requests", "rate_limit_exceeded"), headers
+
+    return start_standin(respond), counts
+
+
+def _worker(env: dict, calls: int, out: "mp.Queue") -> None:
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import llm_client
+    from upstream_guard import Deadline
+
+    for _ in range(calls):
+        llm_client.generate_reply("support", [{"role": "user", "content": "今天好累"}], deadline=Deadline(5))
+    out.put(llm_client.upstream_stats.snapshot())
+
+
+def run(governed: bool) -> int:
+    server, counts = make_standin(STANDIN_RPM)
+    tmp = tempfile.mkdtemp()
+    env = {
+        "OPENAI_API_KEY": "standin",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "RATE_GOVERNOR_DB_PATH": os.path.join(tmp, "governor.sqlite3"),
+        "USAGE_DB_PATH": os.path.join(tmp, "usage.sqlite3"),
+        "OPENAI_RPM_LIMIT": str(STANDIN_RPM) if governed else "0",
+        "OPENAI_TPM_LIMIT": "0",
+        "LLM_MAX_RETRIES": "0",
+    }
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(env, CALLS_PER_WORKER, out)) for _ in range(WORKERS)]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    stats = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    server.shutdown()
+
+    rejected = sum(s.get("governor_rejected", 0) for s in stats)
+    label = "governor on " if governed else "governor off"
+    print(
+        f"{label}: upstream ok={counts['ok']:>3}  upstream 429={counts['429']:>3}  "
+        f"paced/rejected locally={rejected:>3}  wall={time.perf_counter() - started:.1f}s"
+    )
+    return counts["429"]
+
+
+def main() -> int:
+    ungoverned = run(governed=False)
+    governed = run(governed=True)
+    if ungoverned == 0:
+        print("FAIL: the stand-in never returned 429 without the governor; the check proves nothing")
+        return 1
+    if governed > ungoverned * MAX_GOVERNED_429_RATIO:
+        print(f"FAIL: governed 429s ({governed}) not clearly below ungoverned ({ungoverned})")
+        return 1
+    print(f"OK: 429s {ungoverned} -> {governed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
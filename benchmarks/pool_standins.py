@@ -0,0 +1,148 @@
+# benchmarks/pool_standins.py
+"""
+多 endpoint 連線池驗證：本機起三個速度 / 穩定度不同的 OpenAI 相容 stand-in
+
+- fast：約 50ms；slow：約 400ms；flaky：約 80ms，但第一階段全部回 500（/models 也失敗）
+- 第一階段：併發呼叫 generate_reply，看流量分配、失敗重試換 endpoint、flaky 被剔除
+- 第二階段：flaky 恢復正常，等背景健康檢查把它放回來，再跑一輪
+- 檢查：第一階段多數由 fast 服務、flaky 有被剔除、第二階段 flaky 重新分到流量、
+  兩階段都沒有本地 fallback；任一不成立 exit code 1
+
+用法：python benchmarks/pool_standins.py（不需要網路 / API Key）
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from _standin import ERROR_BODY, MODELS_BODY, OK_BODY, start_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CALLS_PER_PHASE = 60
+CONCURRENCY = 8
+
+def make_standin(latency_s: float, state: dict):
+    """state["fail_rate"] 可在執行中調整；state["counts"] 記錄收到的請求"""
+    lock = threading.Lock()
+
+    def respond(method: str, path: str):
+        if method == "GET":
+            if not path.rstrip("/").endswith("/models"):
+                return 404, ERROR_BODY, {}
+            ok = state["fail_rate"] < 1.0
+            return (200, MODELS_BODY, {}) if ok else (503, ERROR_BODY, {})
+        time.sleep(latency_s * random.uniform(0.8, 1.2))
+        failed = random.random() < state["fail_rate"]
+        with lock:
+            state["counts"]["500" if failed else "ok"] += 1
+        return (500, ERROR_BODY, {}) if failed else (200, OK_BODY, {})
+
+    return start_standin(respond)
+
+
+def _run_phase(llm_client, label: str) -> Counter:
+    """回傳各 endpoint 服務的請求數（本地 fallback 記在 "fallback"）"""
+    from upstream_guard import Deadline
+
+    def call(_):
+        return llm_client.generate_reply_detailed(
+            "support", [{"role": "user", "content": "今天好累"}], deadline=Deadline(10)
+        )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as ex:
+        results = list(ex.map(call, range(CALLS_PER_PHASE)))
+    wall = time.perf_counter() - started
+
+    served = Counter("fallback" if r["fallback"] else r["endpoint"] for r in results)
+    latencies = sorted(r["latency_ms"] for r in results)
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"\n== {label} ==")
+    print(f"served by: {dict(served)}  wall={wall:.1f}s  p50={p50}ms  p95={p95}ms")
+    for snap in llm_client.pool.snapshot():
+        print(
+            f"  {snap['name']:<6} latency={snap['latency_ms']}ms  error_rate={snap['error_rate']}  "
+            f"samples={snap['samples']}  ejected={snap['ejected']}  times_ejected={snap['times_ejected']}"
+        )
+    return served
+
+
+def _check(phase1: Counter, phase2: Counter, times_ejected: int) -> list[str]:
+    problems = []
+    if phase1["fast"] * 2 <= CALLS_PER_PHASE:
+        problems.append(f"fast served {phase1['fast']}/{CALLS_PER_PHASE} in phase 1, expected most of it")
+    if times_ejected < 1:
+        problems.append("flaky was never ejected while failing")
+    if phase2["flaky"] == 0:
+        problems.append("flaky served nothing in phase 2 after recovering")
+    if phase1["fallback"] or phase2["fallback"]:
+        problems.append(f"local fallbacks: phase 1={phase1['fallback']}  phase 2={phase2['fallback']}")
+    return problems
+
+
+def main() -> int:
+    states = {
+        name: {"fail_rate": rate, "counts": Counter()}
+        for name, rate in (("fast", 0.0), ("slow", 0.0), ("flaky", 1.0))
+    }
+    servers = {
+        "fast": make_standin(0.05, states["fast"]),
+        "slow": make_standin(0.40, states["slow"]),
+        "flaky": make_standin(0.08, states["flaky"]),
+    }
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        "OPENAI_ENDPOINTS": json.dumps([
+            {"name": name, "api_key": "standin", "base_url": f"http://127.0.0.1:{srv.server_address[1]}/v1"}
+            for name, srv in servers.items()
+        ]),
+        "RATE_GOVERNOR_DB_PATH": os.path.join(tmp, "governor.sqlite3"),
+        "USAGE_DB_PATH": os.path.join(tmp, "usage.sqlite3"),
+        "OPENAI_RPM_LIMIT": "0",
+        "OPENAI_TPM_LIMIT": "0",
+        "LLM_BACKOFF_BASE_S": "0.05",
+        "POOL_EJECT_BASE_S": "3",
+        "POOL_HEALTH_INTERVAL_S": "1",
+    })
+    sys.path.insert(0, ROOT)
+    import llm_client
+
+    phase1 = _run_phase(llm_client, "phase 1: flaky returns 500")
+    flaky_ejections = next(s["times_ejected"] for s in llm_client.pool.snapshot() if s["name"] == "flaky")
+
+    states["flaky"]["fail_rate"] = 0.0
+    # 等剔除期過、健康檢查把 flaky 放回來
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline and any(s["ejected"] for s in llm_client.pool.snapshot()):
+        time.sleep(0.5)
+
+    phase2 = _run_phase(llm_client, "phase 2: flaky healthy again")
+
+    print("\nupstream requests per stand-in:")
+    for name, state in states.items():
+        print(f"  {name:<6} {dict(state['counts'])}")
+    print(f"upstream stats: {llm_client.upstream_stats.snapshot()}")
+    for srv in servers.values():
+        srv.shutdown()
+
+    problems = _check(phase1, phase2, flaky_ejections)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        return 1
+    print("OK: fast carried phase 1, flaky was ejected and came back, no fallbacks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
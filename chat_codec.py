@@ -0,0 +1,187 @@
+# chat_codec.py
+from __future__ import annotations
+
+import json
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    # orjson 比標準 json 快數倍；沒裝就退回標準庫
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# =========================
+# 上限設定（環境變數可覆寫）
+# =========================
+
+# 整個 request body 的 byte 上限（超過直接 413，不進 parser）
+MAX_BODY_BYTES = int(os.getenv("CHAT_MAX_BODY_BYTES", str(256 * 1024)))
+
+# 只保留最近 N 則訊息（較舊的對話直接丟棄）
+MAX_MESSAGES = int(os.getenv("CHAT_MAX_MESSAGES", "60"))
+
+# 單則訊息內容的字元上限（超過就截斷）
+MAX_CONTENT_CHARS = int(os.getenv("CHAT_MAX_CONTENT_CHARS", "4000"))
+
+_ALLOWED_ROLES = ("user", "assistant")
+
+# session_id 由前端產生，只當統計用的不透明字串
+MAX_SESSION_ID_CHARS = 64
+
+# request_id 由前端每次送出時產生（重送時沿用），會拿來當 key / 檔名，只接受安全字元
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def valid_request_id(request_id: Optional[str]) -> bool:
+    return bool(_REQUEST_ID_RE.match(request_id or ""))
+
+
+class ChatRequest(NamedTuple):
+    mode: str
+    messages: List[Dict[str, str]]
+    session_id: Optional[str] = None
+    request_id: Optional[str] = None
+
+
+class ChatPayloadError(ValueError):
+    """請求格式不合法；status 對應要回給 client 的 HTTP 狀態碼"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+# =========================
+# JSON encode / decode
+# =========================
+def loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# =========================
+# 驗證 / 正規化
+# =========================
+def _normalize_message(m: Any) -> Optional[Dict[str, str]]:
+    """
+    單則訊息正規化：
+    - 不是 dict → 丟棄
+    - role 不是 user/assistant → 當 user
+    - content 只接受字串或數字；其他型別（list/dict/None）丟棄，不做 str()
+    - 空白內容丟棄，過長內容截斷
+    """
+    if not isinstance(m, dict):
+        return None
+
+    role = m.get("role")
+    role = role.strip() if isinstance(role, str) else "user"
+    if role not in _ALLOWED_ROLES:
+        role = "user"
+
+    content = m.get("content", "")
+    if isinstance(content, bool):
+        return None
+    if isinstance(content, (int, float)):
+        content = str(content)
+    elif not isinstance(content, str):
+        return None
+
+    content = content.strip()
+    if not content:
+        return None
+    if len(content) > MAX_CONTENT_CHARS:
+        content = content[:MAX_CONTENT_CHARS]
+
+    return {"role": role, "content": content}
+
+
+def validate_chat_payload(data: Any) -> ChatRequest:
+    """
+    驗證已 decode 的 payload，回傳 ChatRequest(mode, messages, session_id, request_id)
+    - messages 先切到最後 MAX_MESSAGES 則再逐則正規化，避免巨大歷史被完整走訪
+    """
+    if not isinstance(data, dict):
+        raise ChatPayloadError("payload must be a JSON object")
+
+    mode = data.get("mode", "support")
+    if not isinstance(mode, str):
+        raise ChatPayloadError("mode must be a string")
+
+    raw_messages = data.get("messages", [])
+    if raw_messages is None:
+        raw_messages = []
+    if not isinstance(raw_messages, list):
+        raise ChatPayloadError("messages must be a list")
+
+    messages: List[Dict[str, str]] = []
+    for m in raw_messages[-MAX_MESSAGES:]:
+        norm = _normalize_message(m)
+        if norm is not None:
+            messages.append(norm)
+
+    session_id = data.get("session_id")
+    if not isinstance(session_id, str) or not session_id.strip():
+        session_id = None
+    else:
+        session_id = session_id.strip()[:MAX_SESSION_ID_CHARS]
+
+    request_id = data.get("request_id")
+    if request_id is not None and not (isinstance(request_id, str) and valid_request_id(request_id)):
+        raise ChatPayloadError("request_id must be 1-64 chars of [A-Za-z0-9_-]")
+
+    return ChatRequest(mode, messages, session_id, request_id)
+
+
+def _load_bounded(raw: bytes) -> Any:
+    """在 parse 前先擋掉超過 MAX_BODY_BYTES 的 body"""
+    if len(raw) > MAX_BODY_BYTES:
+        raise ChatPayloadError("request body too large", status=413)
+    try:
+        return loads(raw)
+    except ValueError as e:  # orjson.JSONDecodeError / json.JSONDecodeError 皆為 ValueError
+        raise ChatPayloadError(f"invalid JSON: {e}") from e
+
+
+def decode_chat_request(raw: bytes) -> ChatRequest:
+    """
+    raw body → ChatRequest
+    """
+    return validate_chat_payload(_load_bounded(raw))
+
+
+# =========================
+# /api/compare
+# =========================
+COMPARE_MODES = ("cbt", "support", "analytic")
+
+
+def decode_compare_request(raw: bytes) -> Tuple[List[str], ChatRequest]:
+    """
+    raw body → (modes, ChatRequest)
+    - modes 省略時預設三種全比；只接受 cbt / support / analytic，重複的會去掉
+    """
+    data = _load_bounded(raw)
+    chat_request = validate_chat_payload(data)
+
+    modes = data.get("modes") or list(COMPARE_MODES)
+    if not isinstance(modes, list) or not all(isinstance(m, str) for m in modes):
+        raise ChatPayloadError("modes must be a list of strings")
+
+    unique: List[str] = []
+    for m in modes:
+        m = m.strip()
+        if m not in COMPARE_MODES:
+            raise ChatPayloadError(f"unknown mode: {m!r} (allowed: {', '.join(COMPARE_MODES)})")
+        if m not in unique:
+            unique.append(m)
+    return unique, chat_request
@@ -0,0 +1,264 @@
+# job_queue.py
+"""
+非同步 chat job：
+- POST 立刻回 job_id；實際的上游呼叫交給本 process 的背景 worker threads
+- 待處理佇列有上限（滿了就拒絕，不無限堆積）
+- 結果寫進本機 SQLite，帶 TTL；任何 gunicorn worker 都能回應 long-poll
+- 過期的 job（含回覆原文）會在 submit、查詢與 worker 閒置時刪除，不長留在磁碟上
+
+部署注意：long-poll 會佔住處理它的那條執行緒。sync worker 一次只處理一個請求，
+請改用 threaded worker，例如 gunicorn --worker-class gthread --threads 8 app:app
+"""
+from __future__ import annotations
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "32"))
+JOB_TTL_S = float(os.getenv("JOB_TTL_S", "600"))
+
+# 單次 long-poll 最多掛多久（要比主機的 request timeout 短；越短越不佔 worker）
+JOB_MAX_WAIT_S = float(os.getenv("JOB_MAX_WAIT_S", "8"))
+
+# 跨 process 時查 SQLite 的間隔
+_POLL_INTERVAL_S = 0.25
+
+# 查詢時順手清過期 job 的最短間隔；worker 閒置這麼久也會清一次
+_PURGE_INTERVAL_S = 30.0
+
+# 狀態寫入失敗（例如 database is locked）時的重試次數
+_WRITE_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+)
+"""
+
+_FINAL = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    """待處理 job 已達上限"""
+
+
+class JobQueue:
+    def __init__(
+        self,
+        handler: Callable[[Any], Dict[str, Any]],
+        db_path: str = JOB_DB_PATH,
+        workers: int = JOB_WORKERS,
+        max_pending: int = JOB_MAX_PENDING,
+        ttl_s: float = JOB_TTL_S,
+    ):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.ttl_s = ttl_s
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max_pending)
+        self._events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._threads: list = []
+        self._counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "expired": 0, "write_errors": 0}
+        self._last_purge = 0.0
+
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+        finally:
+            conn.close()
+
+    # ---------- SQLite ----------
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _write(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO jobs (id, status, result, error, created, expires) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET status = excluded.status, result = excluded.result,
+                    error = excluded.error, expires = excluded.expires
+                """,
+                (
+                    job_id, status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error, now, now + self.ttl_s,
+                ),
+            )
+        finally:
+            conn.close()
+
+    def _write_quietly(self, job_id: str, status: str, **kwargs: Any) -> bool:
+        """worker 用：寫入失敗就重試，最後只記 log，不讓 worker thread 因此結束"""
+        for attempt in range(_WRITE_ATTEMPTS):
+            try:
+                self._write(job_id, status, **kwargs)
+                return True
+            except sqlite3.Error as e:
+                last_error = e
+                time.sleep(0.1 * (attempt + 1))
+        with self._lock:
+            self._counts["write_errors"] += 1
+        print(f"[job_queue] could not mark job {job_id} as {status}: {last_error}")
+        return False
+
+    def _purge_expired(self) -> None:
+        self._last_purge = time.monotonic()
+        conn = self._connect()
+        try:
+            cur = conn.execute("DELETE FROM jobs WHERE expires < ?", (time.time(),))
+            if cur.rowcount:
+                with self._lock:
+                    self._counts["expired"] += cur.rowcount
+        finally:
+            conn.close()
+
+    def _maybe_purge(self) -> None:
+        if time.monotonic() - self._last_purge < _PURGE_INTERVAL_S:
+            return
+        try:
+            self._purge_expired()
+        except sqlite3.Error as e:
+            print(f"[job_queue] purge failed: {e}")
+
+    # ---------- worker ----------
+    def _ensure_workers(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"chat-job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self) -> None:
+        while True:
+            try:
+                job_id, payload = self._queue.get(timeout=_PURGE_INTERVAL_S)
+            except queue.Empty:
+                self._maybe_purge()
+                continue
+
+            try:
+                self._write_quietly(job_id, "running")
+                try:
+                    result = self.handler(payload)
+                except Exception as e:
+                    outcome = "failed"
+                    self._write_quietly(job_id, "failed", error=str(e))
+                else:
+                    outcome = "done"
+                    if not self._write_quietly(job_id, "done", result=result):
+                        outcome = "failed"
+            except Exception as e:
+                # 保底：任何意外都不能讓 worker thread 結束
+                outcome = "failed"
+                print(f"[job_queue] job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+            with self._lock:
+                self._counts[outcome] += 1
+                event = self._events.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    # ---------- 公開 API ----------
+    def submit(self, payload: Any) -> str:
+        self._ensure_workers()
+        self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        # 先寫 queued，避免 worker 太快完成後又被覆寫
+        self._write(job_id, "queued")
+        with self._lock:
+            self._events[job_id] = threading.Event()
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                self._events.pop(job_id, None)
+                self._counts["rejected"] += 1
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            finally:
+                conn.close()
+            raise JobQueueFull("too many pending jobs")
+
+        with self._lock:
+            self._counts["submitted"] += 1
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._maybe_purge()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT status, result, error, expires FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None or row[3] < time.time():
+            return None
+        status, result, error, _ = row
+        out: Dict[str, Any] = {"job_id": job_id, "status": status}
+        if result is not None:
+            out.update(json.loads(result))
+        if error is not None:
+            out["error"] = error
+        return out
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        long-poll：等到 job 結束或 timeout
+        - job 在本 process：等 threading.Event
+        - job 在別的 worker：每 _POLL_INTERVAL_S 查一次 SQLite
+        """
+        timeout = max(0.0, min(timeout, JOB_MAX_WAIT_S))
+        deadline = time.monotonic() + timeout
+
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+            return self.get(job_id)
+
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in _FINAL:
+                return job
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return job
+            time.sleep(min(_POLL_INTERVAL_S, left))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._counts)
+        out["pending"] = self._queue.qsize()
+        return out
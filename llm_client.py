@@ -1,13 +1,29 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from textwrap import dedent
+from typing import Iterator
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIStatusError
 
 from cbt_mode import build_cbt_instruction
-from psy_interview_prompt import build_psy_interview_instruction
+from psy_interview_prompt import build_psy_interview_instruction, build_psy_safety_instruction
 from supportive_mode import build_supportive_prompt
 from analytic_mode import build_analytic_prompt
+from upstream_guard import (
+    MAX_RETRIES,
+    MIN_CALL_S,
+    CircuitBreaker,
+    Deadline,
+    UpstreamStats,
+    backoff_delay,
+    is_retryable,
+)
+from usage_ledger import ledger, usage_from_response
+from rate_governor import RateGovernor, RateLimitWaitExceeded, estimate_tokens
+from upstream_pool import Endpoint, UpstreamPool, load_endpoints
+from prompt_variants import DEFAULT_VARIANT, PromptVariant, assign_variant, meets_length_rule, reply_length
 
 
 # =========================
@@ -22,19 +38,33 @@ if not api_key:
     load_dotenv()
     api_key = os.getenv("OPENAI_API_KEY")
 
-if not api_key:
-    raise RuntimeError("OPENAI_API_KEY not found. Set it in environment or .env")
+# ③ 上游 endpoint 池：有設 OPENAI_ENDPOINTS 就用多組，否則只用 OPENAI_API_KEY 一組
+#    （沒有任何可用 key 時 load_endpoints 會直接 raise）
+#    每個 client 都關掉 SDK 內建重試，由 generate_reply 自行控制（配合 deadline / 斷路器）
+pool = UpstreamPool(load_endpoints(api_key))
+
+# 全程共用的斷路器與計數（每個 worker process 各一份）
+breaker = CircuitBreaker()
+upstream_stats = UpstreamStats()
+
+# 跨 worker 共用的 RPM / TPM 限流器（狀態在本機 SQLite）
+governor = RateGovernor()
 
-client = OpenAI(api_key=api_key)
+# 多模式比較用的共用 thread pool（限制同時對上游發出的 fan-out 數）
+COMPARE_MAX_WORKERS = int(os.getenv("COMPARE_MAX_WORKERS", "6"))
+_compare_pool = ThreadPoolExecutor(max_workers=COMPARE_MAX_WORKERS, thread_name_prefix="compare")
 
 # 預設模型
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 
 
-def get_model_name(mode: str) -> str:
+def get_model_name(mode: str, endpoint: Endpoint | None = None) -> str:
     """
     未來如果想讓不同模式用不同模型，可以在這裡集中管理。
+    - endpoint 有指定 model（例如自架相容伺服器）時以它為準
     """
+    if endpoint is not None and endpoint.model:
+        return endpoint.model
     # 目前所有 mode 共用同一個模型
     return OPENAI_MODEL
 
@@ -43,37 +73,38 @@ def get_model_name(mode: str) -> str:
 # 核心系統提示詞 (The Brain & Safety Guard)
 # ==========================================
 
-SYSTEM_PROMPT_BASE = (
-    dedent(
-        """
-        你是一位溫柔、專業、具備實證思維的心理支持助手。
-
-        【核心運作邏輯：隱性思維鏈】
-        在你產生任何回應之前，請先在「內心」進行以下三步驟評估（不要輸出這些步驟，只輸出最終回應）：
-
-        1. **安全與風險評估 (Safety Check - Critical)**
-           - 偵測關鍵字：自殺、自傷、傷害他人、絕望感 (Hopelessness)。
-           - 若有高風險：必須停止常規對話，立即切換至「危機介入模式」，提供同理並給予求助資源。
-
-        2. **同理心檢核 (Validity Check)**
-           - 在提供建議前，先用情感反映確認自己有沒有抓到對方的心情。
-           - 優先接住情緒，再往下問細節。
-
-        3. **介入階段判斷 (Stage Decision)**
-           - 判斷使用者現在主要需要的是：宣洩 / 被理解、還是問題解決與規劃。
-           - 若情緒非常強烈，先穩定與安撫；情緒較穩時，再進入認知或行為面的整理。
-
-        【回應風格指引】
-        - 語氣：溫暖 × 穩定 × 清晰，像是一位坐在旁邊的資深治療師，聚焦在核心引導使用者說更多。
-        - 原則：合作式實證 (Collaborative Empiricism)，與使用者一起看證據、一起思考。
-        - 結構：段落清楚，便於在手機上閱讀。
-        - 限制：每次回應結尾「最多只問一個聚焦問題」或只給一個小任務，避免像在審問。
-        - 禁止：多餘的寒暄語句 (例如「希望這對你有幫助」等)。
-        """
-    ).strip()
-    + "\n\n"
-    + build_psy_interview_instruction()
-)
+SYSTEM_PROMPT_CORE = dedent(
+    """
+    你是一位溫柔、專業、具備實證思維的心理支持助手。
+
+    【核心運作邏輯：隱性思維鏈】
+    在你產生任何回應之前，請先在「內心」進行以下三步驟評估（不要輸出這些步驟，只輸出最終回應）：
+
+    1. **安全與風險評估 (Safety Check - Critical)**
+       - 偵測關鍵字：自殺、自傷、傷害他人、絕望感 (Hopelessness)。
+       - 若有高風險：必須停止常規對話，立即切換至「危機介入模式」，提供同理並給予求助資源。
+
+    2. **同理心檢核 (Validity Check)**
+       - 在提供建議前，先用情感反映確認自己有沒有抓到對方的心情。
+       - 優先接住情緒，再往下問細節。
+
+    3. **介入階段判斷 (Stage Decision)**
+       - 判斷使用者現在主要需要的是：宣洩 / 被理解、還是問題解決與規劃。
+       - 若情緒非常強烈，先穩定與安撫；情緒較穩時，再進入認知或行為面的整理。
+
+    【回應風格指引】
+    - 語氣：溫暖 × 穩定 × 清晰，像是一位坐在旁邊的資深治療師，聚焦在核心引導使用者說更多。
+    - 原則：合作式實證 (Collaborative Empiricism)，與使用者一起看證據、一起思考。
+    - 結構：段落清楚，便於在手機上閱讀。
+    - 限制：每次回應結尾「最多只問一個聚焦問題」或只給一個小任務，避免像在審問。
+    - 禁止：多餘的寒暄語句 (例如「希望這對你有幫助」等)。
+    """
+).strip()
+
+SYSTEM_PROMPT_BASE = SYSTEM_PROMPT_CORE + "\n\n" + build_psy_interview_instruction()
+
+# 精簡版（lean 變體）：去掉會談技巧，但保留自殺/暴力風險與安全優先段落
+SYSTEM_PROMPT_LEAN = SYSTEM_PROMPT_CORE + "\n\n" + build_psy_safety_instruction()
 
 # - 禁止：診斷用語、長篇心理教育、連續問多題、括號內補充、清單/符號列點、引用規則。
 #     - 若使用者提供很多細節：只抓一個最核心感受回應，其餘留給提問邀請。
@@ -111,16 +142,21 @@ def build_mode_instruction(mode: str, messages: list[dict] | None = None) -> str
     return fn(messages)
 
 
-def _build_openai_messages(mode: str, messages: list[dict] | None) -> list[dict]:
+def _build_openai_messages(
+    mode: str,
+    messages: list[dict] | None,
+    variant: PromptVariant = DEFAULT_VARIANT,
+) -> list[dict]:
     """
     組合 System Prompt 與 對話紀錄
+    - variant：prompt 實驗變體（見 prompt_variants.py），預設為 control
     """
     messages = messages or []
 
     system_instruction = (
-        OUTPUT_RULES
+        (variant.output_rules or OUTPUT_RULES)
         + "\n\n"
-        + SYSTEM_PROMPT_BASE
+        + (SYSTEM_PROMPT_BASE if variant.include_interview_frame else SYSTEM_PROMPT_LEAN)
         + "\n\n"
         + build_mode_instruction(mode, messages=messages)
     )
@@ -145,37 +181,282 @@ def _build_openai_messages(mode: str, messages: list[dict] | None) -> list[dict]
     return openai_messages
 
 
-def generate_reply(mode: str, messages: list[dict]) -> str:
+# ==========================================
+# 本地 fallback（斷路器打開 / 上游持續失敗時使用）
+# ==========================================
+
+FALLBACK_REPLIES = {
+    "cbt": (
+        "我這邊暫時連不上思考的引擎，先陪你做一件小事："
+        "把剛剛那個情境裡，腦中跳出的第一個念頭寫下來，"
+        "再替它的可信度打個 0-100 分。等一下我們再一起看。"
+    ),
+    "analytic": (
+        "我這邊暫時有點連線上的卡住，沒辦法好好回應你。"
+        "你剛剛說的我都還記著；如果願意，先留意一下此刻心裡最明顯的感覺，"
+        "稍後我們可以從那裡繼續。"
+    ),
+    "support": (
+        "我這邊暫時連線不太穩，沒辦法好好回應你，真的抱歉。"
+        "你說的話都很重要；先深呼吸幾次，照顧一下自己，稍後再試一次好嗎？"
+        "如果此刻感到危險或撐不住，請立即撥打 1925 安心專線或 119。"
+    ),
+}
+
+
+def canonical_mode(mode: str) -> str:
     """
-    主函式：呼叫 OpenAI API
+    把各種 mode 別名收斂成 cbt / support / analytic 三種
     """
-    try:
-        openai_messages = _build_openai_messages(mode, messages)
-        model_name = get_model_name(mode)
+    mode_key = (mode or "").strip()
+    if mode_key == "cbt":
+        return "cbt"
+    if mode_key in ("分析性", "psychodynamic", "analytic"):
+        return "analytic"
+    return "support"
 
-        # 保留你原本的 Responses API 用法
-        response = client.responses.create(
-            model=model_name,
-            input=openai_messages,
-        )
 
-        # 解析回傳（相容性處理）
-        reply_text = None
+def build_fallback_reply(mode: str) -> str:
+    return FALLBACK_REPLIES[canonical_mode(mode)]
 
-        if hasattr(response, "output_text") and response.output_text:
-            reply_text = response.output_text
-        else:
-            # 常見 Responses 結構 fallback
+
+def is_fallback_reply(text: str) -> bool:
+    """
+    generate_reply 沒拿到真正的上游回覆（本地 fallback 或錯誤訊息）
+    """
+    return text in FALLBACK_REPLIES.values() or text.startswith("連線發生錯誤：")
+
+
+def resolve_submode(mode: str, messages: list[dict] | None) -> str | None:
+    """
+    只有分析性模式有子模式；與 build_analytic_prompt 用同一個 router
+    """
+    if canonical_mode(mode) != "analytic":
+        return None
+    _, submode = build_analytic_prompt(messages=messages, return_debug=True)
+    return submode
+
+
+def get_upstream_stats() -> dict:
+    """
+    監控用：斷路器狀態 + 呼叫/重試計數
+    """
+    return {
+        "breaker": breaker.snapshot(),
+        "counters": upstream_stats.snapshot(),
+        "governor": governor.snapshot(),
+        "pool": pool.snapshot(),
+    }
+
+
+def _extract_reply_text(response) -> str:
+    """
+    解析回傳（相容性處理）
+    """
+    reply_text = None
+
+    if hasattr(response, "output_text") and response.output_text:
+        reply_text = response.output_text
+    else:
+        # 常見 Responses 結構 fallback
+        try:
+            reply_text = response.output[0].content[0].text.value
+        except Exception:
+            # 再 fallback（若被以 chat.completions 類結構回傳）
             try:
-                reply_text = response.output[0].content[0].text.value
+                reply_text = response.choices[0].message.content
             except Exception:
-                # 再 fallback（若被以 chat.completions 類結構回傳）
-                try:
-                    reply_text = response.choices[0].message.content
-                except Exception:
-                    reply_text = "（系統繁忙，請稍後再試。）"
+                reply_text = "（系統繁忙，請稍後再試。）"
 
-        return (reply_text or "").strip()
+    return (reply_text or "").strip()
 
+
+def generate_reply_detailed(
+    mode: str,
+    messages: list[dict],
+    deadline: Deadline | None = None,
+    session_id: str | None = None,
+    source: str = "chat",
+) -> dict:
+    """
+    主函式：呼叫 OpenAI API，回傳回覆與量測資訊
+    - deadline：端到端時間預算，每次上游呼叫只用剩餘時間當 timeout
+    - 可重試錯誤（逾時 / 連線 / 429 / 5xx）做有限次 jitter 退避重試
+    - 斷路器打開時直接回本地 fallback，不再等上游逾時
+    - 成功時把 response.usage 記進 usage_ledger（依 session / mode / submode）
+    - source：記帳用的流量來源（chat / compare），並排比較不算成一般聊天回合
+
+    回傳欄位：reply / mode / submode / variant / model / latency_ms / fallback /
+    input_tokens / cached_tokens / output_tokens（成功時另有 endpoint）
+    """
+    deadline = deadline or Deadline()
+    started = time.perf_counter()
+    usage = {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+    variant = assign_variant(canonical_mode(mode), session_id)
+
+    def _result(reply: str, fallback: bool, model: str | None = None) -> dict:
+        return {
+            "reply": reply,
+            "mode": canonical_mode(mode),
+            "submode": resolve_submode(mode, messages),
+            "variant": variant.id,
+            "model": model,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "fallback": fallback,
+            **usage,
+        }
+
+    try:
+        openai_messages = _build_openai_messages(mode, messages, variant=variant)
     except Exception as e:
-        return f"連線發生錯誤：{e}\n請檢查網路或 API Key 設定。"
+        return _result(f"連線發生錯誤：{e}\n請檢查網路或 API Key 設定。", fallback=True)
+
+    if not breaker.allow():
+        upstream_stats.incr("fallbacks")
+        return _result(build_fallback_reply(mode), fallback=True)
+
+    est_tokens = estimate_tokens(openai_messages)
+    failed_endpoints: set = set()
+    call_budget = min(MIN_CALL_S, deadline.seconds / 2)
+
+    attempt = 0
+    while True:
+        # 先跟全 fleet 共用的限流器拿配額；等不到就別再打上游
+        # 等待最多到「剩餘時間 - call_budget」，留時間給真正的上游呼叫
+        try:
+            governor.acquire(tokens=est_tokens, max_wait_s=max(0.0, deadline.remaining() - call_budget))
+        except RateLimitWaitExceeded:
+            upstream_stats.incr("governor_rejected")
+            breaker.release()
+            upstream_stats.incr("fallbacks")
+            return _result(build_fallback_reply(mode), fallback=True)
+
+        timeout = deadline.remaining()
+        if timeout < call_budget:
+            upstream_stats.incr("deadline_exceeded")
+            if attempt == 0:
+                # 還沒打過上游：時間是在本地用掉的，不算上游失敗（不記斷路器、不碰 endpoint 統計）
+                breaker.release()
+                upstream_stats.incr("fallbacks")
+                return _result(build_fallback_reply(mode), fallback=True)
+            break
+
+        # 挑目前最快、最健康的 endpoint；重試時避開這次已失敗的
+        endpoint = pool.acquire(exclude=failed_endpoints)
+        model_name = get_model_name(mode, endpoint)
+        # x-ratelimit-* 是「每組 key」的額度；多 endpoint 時混在一起校正會失真
+        observe_headers = len(pool) == 1
+
+        upstream_stats.incr("calls")
+        call_started = time.perf_counter()
+        try:
+            # 保留你原本的 Responses API 用法（raw response 才拿得到 x-ratelimit-* 標頭）
+            raw = endpoint.client.with_options(timeout=timeout).responses.with_raw_response.create(
+                model=model_name,
+                input=openai_messages,
+            )
+            if observe_headers:
+                governor.observe_headers(raw.headers)
+            response = raw.parse()
+        except Exception as e:
+            if isinstance(e, APIStatusError):
+                throttled = e.status_code == 429
+                if throttled:
+                    upstream_stats.incr("throttled")
+                if observe_headers:
+                    governor.observe_headers(e.response.headers, throttled=throttled)
+
+            if not is_retryable(e):
+                # 請求本身的問題（參數 / 認證），不算上游健康度
+                pool.cancel(endpoint)
+                breaker.release()
+                return _result(f"連線發生錯誤：{e}\n請檢查網路或 API Key 設定。", fallback=True)
+
+            pool.release(endpoint, latency_ms=None, ok=False)
+            failed_endpoints.add(endpoint.name)
+
+            if attempt >= MAX_RETRIES:
+                break
+            delay = backoff_delay(attempt)
+            if delay + call_budget > deadline.remaining():
+                upstream_stats.incr("deadline_exceeded")
+                break
+            time.sleep(delay)
+            attempt += 1
+            upstream_stats.incr("retries")
+            continue
+
+        pool.release(endpoint, latency_ms=(time.perf_counter() - call_started) * 1000, ok=True)
+        breaker.record_success()
+        upstream_stats.incr("successes")
+        usage = usage_from_response(response)
+        result = _result(_extract_reply_text(response), fallback=False, model=model_name)
+        result["endpoint"] = endpoint.name
+        ledger.record(
+            mode=result["mode"],
+            submode=result["submode"],
+            variant=variant.id,
+            model=model_name,
+            session_id=session_id,
+            wall_ms=result["latency_ms"],
+            reply_chars=reply_length(result["reply"]),
+            length_ok=meets_length_rule(result["reply"]),
+            source=source,
+            **usage,
+        )
+        return result
+
+    breaker.record_failure()
+    upstream_stats.incr("failures")
+    upstream_stats.incr("fallbacks")
+    return _result(build_fallback_reply(mode), fallback=True)
+
+
+def generate_reply(
+    mode: str,
+    messages: list[dict],
+    deadline: Deadline | None = None,
+    session_id: str | None = None,
+) -> str:
+    """
+    只要回覆文字時用這個（見 generate_reply_detailed）
+    """
+    return generate_reply_detailed(mode, messages, deadline=deadline, session_id=session_id)["reply"]
+
+
+def generate_replies_concurrently(
+    modes: list[str],
+    messages: list[dict],
+    deadline: Deadline | None = None,
+    session_id: str | None = None,
+) -> Iterator[dict]:
+    """
+    同一段對話同時用多個 mode 生成，哪個先完成就先 yield 哪個
+    - 總耗時 ≈ 最慢的單一呼叫，而不是全部相加
+    - 共用同一個 deadline
+    - 記帳標成 compare，不混進一般聊天的 session / 變體統計
+    """
+    deadline = deadline or Deadline()
+    futures = {
+        _compare_pool.submit(
+            generate_reply_detailed, mode, messages, deadline=deadline, session_id=session_id, source="compare"
+        ): mode
+        for mode in modes
+    }
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except Exception as e:
+            mode = futures[future]
+            yield {
+                "reply": f"連線發生錯誤：{e}",
+                "mode": canonical_mode(mode),
+                "submode": None,
+                "variant": None,
+                "model": None,
+                "latency_ms": None,
+                "fallback": True,
+                "input_tokens": 0,
+                "cached_tokens": 0,
+                "output_tokens": 0,
+            }
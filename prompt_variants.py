@@ -0,0 +1,95 @@
+# prompt_variants.py
+"""
+Prompt 變體實驗：
+- 每個 mode 可以有多個 prompt 變體；session 依 hash 穩定分配（同一個 session 永遠拿到同一個變體）
+- 權重由環境變數 PROMPT_VARIANT_WEIGHTS（JSON）設定，預設全部走 control
+    例：{"support": {"control": 90, "lean": 10}, "cbt": {"control": 50, "lean": 50}}
+- 每次回覆都帶變體 ID，usage_ledger 依變體彙總延遲、tokens、字數規則遵守率
+    查詢：python usage_ledger.py variants
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Dict, NamedTuple, Optional
+
+
+class PromptVariant(NamedTuple):
+    id: str
+    # 是否附上完整的《精神科會談技巧》框架（SYSTEM_PROMPT_BASE 裡最長的一段）
+    # False 時只拿掉會談技巧段落；角色界線與風險/安全段落一律保留
+    include_interview_frame: bool = True
+    # 取代預設 OUTPUT_RULES；None 代表沿用
+    output_rules: Optional[str] = None
+
+
+VARIANTS: Dict[str, PromptVariant] = {
+    "control": PromptVariant("control"),
+    # 精簡版：核心安全 / 同理 / 階段判斷、風險與安全優先段落、mode 指令；去掉其餘會談技巧
+    "lean": PromptVariant("lean", include_interview_frame=False),
+}
+
+DEFAULT_VARIANT = VARIANTS["control"]
+
+# 改變分桶結果時換 salt（例如開新一輪實驗）
+PROMPT_VARIANT_SALT = os.getenv("PROMPT_VARIANT_SALT", "v1")
+
+# OUTPUT_RULES 的字數規則：50-120 字（含標點；不含空白）
+LENGTH_RULE_MIN = 50
+LENGTH_RULE_MAX = 120
+
+
+def _load_weights() -> Dict[str, Dict[str, float]]:
+    raw = os.getenv("PROMPT_VARIANT_WEIGHTS", "")
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        print("[prompt_variants] PROMPT_VARIANT_WEIGHTS is not valid JSON, using control only")
+        return {}
+
+    weights: Dict[str, Dict[str, float]] = {}
+    for mode, table in (data or {}).items():
+        if not isinstance(table, dict):
+            continue
+        clean = {
+            vid: float(w)
+            for vid, w in table.items()
+            if vid in VARIANTS and isinstance(w, (int, float)) and w > 0
+        }
+        if clean:
+            weights[mode] = clean
+    return weights
+
+
+VARIANT_WEIGHTS = _load_weights()
+
+
+def assign_variant(mode: str, session_id: Optional[str]) -> PromptVariant:
+    """
+    依 (salt, mode, session_id) 的 hash 穩定分桶；沒有 session_id 或該 mode 沒設定權重 → control
+    mode 請傳 canonical mode（cbt / support / analytic）
+    """
+    table = VARIANT_WEIGHTS.get(mode)
+    if not table or not session_id:
+        return DEFAULT_VARIANT
+
+    digest = hashlib.sha256(f"{PROMPT_VARIANT_SALT}:{mode}:{session_id}".encode("utf-8")).digest()
+    point = int.from_bytes(digest[:8], "big") / 2**64 * sum(table.values())
+
+    for vid, weight in sorted(table.items()):
+        if point < weight:
+            return VARIANTS[vid]
+        point -= weight
+    return DEFAULT_VARIANT
+
+
+def reply_length(text: str) -> int:
+    """字數規則的算法：含標點、不含空白"""
+    return sum(1 for ch in text if not ch.isspace())
+
+
+def meets_length_rule(text: str) -> bool:
+    return LENGTH_RULE_MIN <= reply_length(text) <= LENGTH_RULE_MAX
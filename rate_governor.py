@@ -0,0 +1,316 @@
+# rate_governor.py
+"""
+跨 process 的上游限流器（requests / tokens 兩個 token bucket）
+- 狀態放在本機 SQLite，所有 gunicorn worker 共用；用 BEGIN IMMEDIATE 互斥，不需外部服務
+- 呼叫前 acquire()：桶子不夠就等待（不超過 deadline），盡量不讓整個 fleet 撞到 429
+- 呼叫後 observe_headers()：依 x-ratelimit-* 回應標頭校正容量與剩餘量
+- SQLite 出錯（例如 database is locked）時 fail open：放行並記 log，不讓限流器本身擋掉聊天
+- 啟動時以設定值（OPENAI_RPM_LIMIT / OPENAI_TPM_LIMIT）更新桶子；上限 0 的桶子刪掉（不限制）
+  資料庫無法建立時整個限流器停用（不限制），app 照常啟動
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+GOVERNOR_DB_PATH = os.getenv("RATE_GOVERNOR_DB_PATH", "rate_governor.sqlite3")
+
+# 每分鐘上限（請填專案實際的 RPM / TPM）；0 代表不限制
+RPM_LIMIT = float(os.getenv("OPENAI_RPM_LIMIT", "500"))
+TPM_LIMIT = float(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+
+# 只用上限的一部分，留緩衝給估算誤差
+HEADROOM = float(os.getenv("RATE_GOVERNOR_HEADROOM", "0.9"))
+
+# 粗估（依字元類別）：中日韓等非 ASCII 約 1 字 ≈ 1 token；英數 / 標點約 4 字 ≈ 1 token
+# 再加上一段回覆的預留量
+TOKENS_PER_CHAR = float(os.getenv("RATE_GOVERNOR_TOKENS_PER_CHAR", "1.0"))
+ASCII_TOKENS_PER_CHAR = float(os.getenv("RATE_GOVERNOR_ASCII_TOKENS_PER_CHAR", "0.25"))
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("RATE_GOVERNOR_EXPECTED_OUTPUT_TOKENS", "400"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    level REAL NOT NULL,
+    capacity REAL NOT NULL,
+    refill_per_s REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class RateLimitWaitExceeded(Exception):
+    """等到 deadline 仍拿不到配額"""
+
+
+def estimate_tokens(openai_messages: list[dict]) -> int:
+    ascii_chars = other_chars = 0
+    for m in openai_messages:
+        text = m.get("content") or ""
+        n_ascii = len(text.encode("ascii", "ignore"))
+        ascii_chars += n_ascii
+        other_chars += len(text) - n_ascii
+    estimate = ascii_chars * ASCII_TOKENS_PER_CHAR + other_chars * TOKENS_PER_CHAR
+    return int(math.ceil(estimate)) + EXPECTED_OUTPUT_TOKENS
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """'1s' / '6m0s' / '20ms' / '0.5' → 秒"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(n) * scale[u] for n, u in parts)
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    try:
+        return headers.get(name)
+    except AttributeError:
+        return None
+
+
+def _rollback(conn: sqlite3.Connection) -> None:
+    # BEGIN 本身失敗時沒有交易可以 rollback，不要蓋掉原本的錯誤
+    try:
+        conn.execute("ROLLBACK")
+    except sqlite3.Error:
+        pass
+
+
+def _as_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateGovernor:
+    def __init__(
+        self,
+        db_path: str = GOVERNOR_DB_PATH,
+        rpm: float = RPM_LIMIT,
+        tpm: float = TPM_LIMIT,
+        headroom: float = HEADROOM,
+    ):
+        self.db_path = db_path
+        self.headroom = headroom
+        self._defaults = {"requests": rpm, "tokens": tpm}
+        self._local_waits = 0
+        self._local_wait_s = 0.0
+        self._db_errors = 0
+        # 所有上限都是 0、或資料庫無法初始化 → 停用（acquire / observe_headers 直接放行）
+        self.enabled = any(v > 0 for v in self._defaults.values())
+        try:
+            self._init_db()
+        except sqlite3.Error as e:
+            self.enabled = False
+            self._db_error("init", e)
+
+    # ---------- SQLite ----------
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None：自己下 BEGIN IMMEDIATE，跨 process 互斥
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _db_error(self, where: str, e: sqlite3.Error) -> None:
+        self._db_errors += 1
+        print(f"[rate_governor] {where} failed, not rate limiting: {e}")
+
+    def _init_db(self) -> None:
+        """建表，並讓每個桶子的容量 / 補充速度跟上目前設定（既有水位保留，但不超過新容量）"""
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                for name, per_min in self._defaults.items():
+                    if per_min <= 0:
+                        conn.execute("DELETE FROM buckets WHERE name = ?", (name,))
+                        continue
+                    cap = per_min * self.headroom
+                    conn.execute(
+                        """
+                        INSERT INTO buckets VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(name) DO UPDATE SET level = MIN(level, excluded.capacity),
+                            capacity = excluded.capacity, refill_per_s = excluded.refill_per_s
+                        """,
+                        (name, cap, cap, cap / 60.0, now),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                _rollback(conn)
+                raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _refill(row: Tuple[float, float, float, float], now: float) -> float:
+        level, capacity, refill_per_s, updated = row
+        return min(capacity, level + max(0.0, now - updated) * refill_per_s)
+
+    def _try_take(self, cost: Dict[str, float]) -> float:
+        """
+        嘗試一次扣配額；成功回 0，否則回需要等待的秒數（不扣）
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            rows = {
+                r[0]: r[1:]
+                for r in conn.execute("SELECT name, level, capacity, refill_per_s, updated FROM buckets")
+            }
+            levels: Dict[str, float] = {}
+            wait = 0.0
+            for name, amount in cost.items():
+                row = rows.get(name)
+                if row is None:
+                    continue
+                level = self._refill(row, now)
+                levels[name] = level
+                # 單次需求比整個桶還大時，以「滿桶」為門檻，避免永遠等不到
+                need = min(amount, row[1])
+                if level < need:
+                    rate = row[2] if row[2] > 0 else 1e-9
+                    # 429 之後 updated 會被設在未來：先等到那個時間點才開始補充
+                    frozen = max(0.0, row[3] - now)
+                    wait = max(wait, frozen + (need - level) / rate)
+
+            if wait == 0.0:
+                for name, level in levels.items():
+                    # 扣款最多一整桶：單一超大請求不能把共用的桶子打成大幅負值、拖累所有 worker
+                    conn.execute(
+                        "UPDATE buckets SET level = ?, updated = ? WHERE name = ?",
+                        (level - min(cost[name], rows[name][1]), now, name),
+                    )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            _rollback(conn)
+            raise
+        finally:
+            conn.close()
+
+    # ---------- 公開 API ----------
+    def acquire(self, tokens: int, max_wait_s: float) -> float:
+        """
+        取得 1 個 request + tokens 個 token 的配額；回傳實際等待秒數
+        等待會超過 max_wait_s 就丟 RateLimitWaitExceeded
+        """
+        if not self.enabled:
+            return 0.0
+        cost = {"requests": 1.0, "tokens": float(tokens)}
+        waited = 0.0
+        while True:
+            try:
+                wait = self._try_take(cost)
+            except sqlite3.Error as e:
+                self._db_error("acquire", e)
+                return waited
+            if wait == 0.0:
+                if waited:
+                    self._local_waits += 1
+                    self._local_wait_s += waited
+                return waited
+            if waited + wait > max_wait_s:
+                raise RateLimitWaitExceeded(f"need to wait {wait:.2f}s for upstream quota")
+            time.sleep(wait)
+            waited += wait
+
+    def observe_headers(self, headers: Mapping[str, str], throttled: bool = False) -> None:
+        """
+        依 x-ratelimit-* 校正：
+        - limit-*：上游實際上限 → 容量與補充速度
+        - remaining-*：上游剩餘量 → 本地水位不得高於它
+        - throttled（收到 429）：桶子清空，並依 reset / retry-after 延後補充
+        """
+        if headers is None or not self.enabled:
+            return
+        try:
+            self._observe(headers, throttled)
+        except sqlite3.Error as e:
+            self._db_error("observe_headers", e)
+
+    def _observe(self, headers: Mapping[str, str], throttled: bool) -> None:
+        retry_after = parse_reset(_header(headers, "retry-after"))
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            for name in ("requests", "tokens"):
+                row = conn.execute(
+                    "SELECT level, capacity, refill_per_s, updated FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                if row is None:
+                    continue
+                level = self._refill(row, now)
+                capacity, refill_per_s = row[1], row[2]
+
+                limit = _as_float(_header(headers, f"x-ratelimit-limit-{name}"))
+                if limit:
+                    capacity = limit * self.headroom
+                    refill_per_s = capacity / 60.0
+
+                remaining = _as_float(_header(headers, f"x-ratelimit-remaining-{name}"))
+                if remaining is not None:
+                    level = min(level, remaining * self.headroom)
+
+                updated = now
+                if throttled:
+                    reset = parse_reset(_header(headers, f"x-ratelimit-reset-{name}")) or retry_after or 1.0
+                    level = 0.0
+                    # 用「未來的 updated」表示在 reset 之前不補充
+                    updated = now + reset
+
+                conn.execute(
+                    "UPDATE buckets SET level = ?, capacity = ?, refill_per_s = ?, updated = ? WHERE name = ?",
+                    (min(level, capacity), capacity, refill_per_s, updated, name),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            _rollback(conn)
+            raise
+        finally:
+            conn.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"enabled": self.enabled}
+        try:
+            conn = self._connect()
+            try:
+                now = time.time()
+                for name, level, capacity, refill_per_s, updated in conn.execute(
+                    "SELECT name, level, capacity, refill_per_s, updated FROM buckets"
+                ):
+                    out[name] = {
+                        "level": round(self._refill((level, capacity, refill_per_s, updated), now), 2),
+                        "capacity": capacity,
+                        "per_minute": round(refill_per_s * 60, 2),
+                    }
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            out["error"] = str(e)
+        out["local_waits"] = self._local_waits
+        out["local_wait_s"] = round(self._local_wait_s, 3)
+        out["db_errors"] = self._db_errors
+        return out
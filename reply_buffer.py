@@ -0,0 +1,315 @@
+# reply_buffer.py
+"""
+可續傳的回覆暫存：
+- 以 (session_id, request_id) 為 key，暫存「生成中」與「已完成」的回覆（短 TTL）
+  讀取時必須帶同一個 session_id，只知道 request_id 拿不到別人的回覆
+- 狀態放在本機 SQLite，所有 gunicorn worker 共用：重連 / 重送落到哪個 worker 都看得到
+- 同一個 request_id 重送時：生成中就等它完成、已完成就直接回，不會再呼叫一次上游
+  非同步 job 會記下 job_id，重送時直接回原本的 job，不再排一個
+  每筆記下內容指紋（mode + messages）；同一個 request_id 換了內容 → ReplyBufferConflict
+- 生成中的項目只保留 REPLY_BUFFER_PENDING_TTL_S：負責生成的 worker 掛掉時，之後的重送可以重新生成
+- client 可帶 offset 只取還沒收到的部分
+- 容量上限：筆數 + 總字元數，超過時先淘汰最舊的已完成項目；淘汰次數列入 metrics
+- SQLite 出錯時 fail open：當作沒有暫存（照常生成），只記 log
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+REPLY_BUFFER_DB_PATH = os.getenv("REPLY_BUFFER_DB_PATH", "reply_buffer.sqlite3")
+REPLY_BUFFER_TTL_S = float(os.getenv("REPLY_BUFFER_TTL_S", "300"))
+# 要比 JOB_DEADLINE_S 長，正常生成中的項目才不會被當成沒人負責
+REPLY_BUFFER_PENDING_TTL_S = float(os.getenv("REPLY_BUFFER_PENDING_TTL_S", "120"))
+REPLY_BUFFER_MAX_ENTRIES = int(os.getenv("REPLY_BUFFER_MAX_ENTRIES", "2000"))
+REPLY_BUFFER_MAX_CHARS = int(os.getenv("REPLY_BUFFER_MAX_CHARS", str(2_000_000)))
+
+# 等別的 worker 生成時查 SQLite 的間隔
+_POLL_INTERVAL_S = 0.25
+
+# 順手清過期項目的最短間隔
+_PURGE_INTERVAL_S = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replies (
+    session_id TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    fingerprint TEXT,
+    status TEXT NOT NULL,
+    text TEXT NOT NULL DEFAULT '',
+    job_id TEXT,
+    expires REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (session_id, request_id)
+)
+"""
+
+# (session_id, request_id)
+Key = Tuple[str, str]
+
+
+class ReplyBufferConflict(Exception):
+    """同一個 request_id 已用於不同內容的請求"""
+
+
+def _rollback(conn: sqlite3.Connection) -> None:
+    try:
+        conn.execute("ROLLBACK")
+    except sqlite3.Error:
+        pass
+
+
+class ReplyBuffer:
+    def __init__(
+        self,
+        db_path: str = REPLY_BUFFER_DB_PATH,
+        ttl_s: float = REPLY_BUFFER_TTL_S,
+        pending_ttl_s: float = REPLY_BUFFER_PENDING_TTL_S,
+        max_entries: int = REPLY_BUFFER_MAX_ENTRIES,
+        max_chars: int = REPLY_BUFFER_MAX_CHARS,
+    ):
+        self.db_path = db_path
+        self.ttl_s = ttl_s
+        self.pending_ttl_s = pending_ttl_s
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+
+        # 本 process 負責生成的項目：同 process 的等待者用 Event，不必輪詢
+        self._lock = threading.Lock()
+        self._events: Dict[Key, threading.Event] = {}
+        self._last_purge = 0.0
+        # 計數是每個 worker process 各自的
+        self._counts = {
+            "claims": 0,
+            "joins": 0,
+            "hits": 0,
+            "misses": 0,
+            "conflicts": 0,
+            "evicted_ttl": 0,
+            "evicted_capacity": 0,
+            "db_errors": 0,
+        }
+
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(_SCHEMA)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._db_error("init", e)
+
+    # ---------- 內部 ----------
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None：自己下 BEGIN IMMEDIATE，跨 process 互斥
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _db_error(self, where: str, e: sqlite3.Error) -> None:
+        with self._lock:
+            self._counts["db_errors"] += 1
+        print(f"[reply_buffer] {where} failed, not buffering: {e}")
+
+    def _incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += n
+
+    def _signal(self, key: Key) -> None:
+        with self._lock:
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _maybe_purge(self, conn: sqlite3.Connection, now: float) -> None:
+        if time.monotonic() - self._last_purge < _PURGE_INTERVAL_S:
+            return
+        self._last_purge = time.monotonic()
+        cur = conn.execute("DELETE FROM replies WHERE expires < ?", (now,))
+        if cur.rowcount:
+            self._incr("evicted_ttl", cur.rowcount)
+
+    def _enforce_caps(self, conn: sqlite3.Connection) -> None:
+        # 只淘汰已完成的（最舊的先）；生成中的還有人在等
+        count, chars = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM replies").fetchone()
+        while count > self.max_entries or chars > self.max_chars:
+            victim = conn.execute(
+                "SELECT session_id, request_id, LENGTH(text) FROM replies WHERE status != 'pending' "
+                "ORDER BY updated LIMIT 1"
+            ).fetchone()
+            if victim is None:
+                break
+            conn.execute("DELETE FROM replies WHERE session_id = ? AND request_id = ?", victim[:2])
+            count -= 1
+            chars -= victim[2]
+            self._incr("evicted_capacity")
+
+    # ---------- 公開 API ----------
+    def claim(self, key: Key, fingerprint: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+        """
+        回傳 (owner, job_id)：
+        - owner=True：第一次看到這個 key（或原本的已過期），呼叫端負責生成並 finish() / abandon()
+        - owner=False：已有人生成中 / 已完成，呼叫端應 wait()；job_id 是原本那次的 job（沒有則 None）
+        - 已有的項目內容指紋不同 → ReplyBufferConflict
+        - SQLite 出錯 → (True, None)：照常生成，只是不暫存
+        """
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    self._maybe_purge(conn, now)
+                    row = conn.execute(
+                        "SELECT fingerprint, job_id FROM replies "
+                        "WHERE session_id = ? AND request_id = ? AND expires >= ?",
+                        (key[0], key[1], now),
+                    ).fetchone()
+                    if row is None:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO replies (session_id, request_id, fingerprint, status, text, "
+                            "job_id, expires, updated) VALUES (?, ?, ?, 'pending', '', NULL, ?, ?)",
+                            (key[0], key[1], fingerprint, now + self.pending_ttl_s, now),
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    _rollback(conn)
+                    raise
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._db_error("claim", e)
+            return True, None
+
+        if row is None:
+            with self._lock:
+                self._events[key] = threading.Event()
+                self._counts["claims"] += 1
+            return True, None
+        if row[0] != fingerprint:
+            self._incr("conflicts")
+            raise ReplyBufferConflict("request_id was already used for a different request")
+        self._incr("joins")
+        return False, row[1]
+
+    def attach_job(self, key: Key, job_id: str) -> None:
+        """記下負責生成這個 key 的 job，之後的重送直接回它"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "UPDATE replies SET job_id = ? WHERE session_id = ? AND request_id = ?",
+                    (job_id, key[0], key[1]),
+                )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._db_error("attach_job", e)
+
+    def finish(self, key: Key, text: str, status: str = "done") -> None:
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    conn.execute(
+                        "UPDATE replies SET status = ?, text = ?, expires = ?, updated = ? "
+                        "WHERE session_id = ? AND request_id = ?",
+                        (status, text, now + self.ttl_s, now, key[0], key[1]),
+                    )
+                    self._enforce_caps(conn)
+                    conn.execute("COMMIT")
+                except Exception:
+                    _rollback(conn)
+                    raise
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._db_error("finish", e)
+        self._signal(key)
+
+    def abandon(self, key: Key) -> None:
+        """生成失敗：移除項目，之後的重送會重新生成"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM replies WHERE session_id = ? AND request_id = ?", key)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._db_error("abandon", e)
+        # 讓還在等的人醒來（會看到 None → 當作 miss）
+        self._signal(key)
+
+    def wait(self, key: Key, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        等到生成結束或 timeout
+        - 本 process 在生成：等 threading.Event
+        - 別的 worker 在生成：每 _POLL_INTERVAL_S 查一次 SQLite
+        """
+        timeout = max(0.0, timeout)
+        with self._lock:
+            event = self._events.get(key)
+        if event is not None:
+            event.wait(timeout)
+            return self.read(key)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            buffered = self.read(key)
+            if buffered is None or buffered["status"] != "pending":
+                return buffered
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return buffered
+            time.sleep(min(_POLL_INTERVAL_S, left))
+
+    def read(self, key: Key, offset: int = 0) -> Optional[Dict[str, Any]]:
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT status, text FROM replies WHERE session_id = ? AND request_id = ? AND expires >= ?",
+                    (key[0], key[1], time.time()),
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._db_error("read", e)
+            row = None
+        if row is None:
+            self._incr("misses")
+            return None
+        self._incr("hits")
+        status, text = row
+        offset = max(0, min(offset, len(text)))
+        return {
+            "request_id": key[1],
+            "status": status,
+            "text": text[offset:],
+            "offset": offset,
+            "length": len(text),
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._counts)
+        try:
+            conn = self._connect()
+            try:
+                out["entries"], out["chars"] = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM replies WHERE expires >= ?",
+                    (time.time(),),
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+        return out
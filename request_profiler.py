@@ -0,0 +1,191 @@
+# request_profiler.py
+"""
+按需的單一請求 profiling（cProfile）
+- 觸發：帶 X-Profile: <PROFILE_ADMIN_TOKEN> 標頭，或依 PROFILE_SAMPLE_RATE 抽樣
+- 結果以 request ID 存成 PROFILE_DIR/<request_id>.prof，之後可用 /api/profiles/<id> 取回
+- 沒開啟時（沒設 token 且抽樣率 0）只多一次判斷，幾乎零成本
+- 同一個 process 同時只跑一個 profile（Python 3.12+ 的 cProfile 是全域的）；忙碌時直接跳過
+- cProfile 只追蹤呼叫它的 thread：背景 job / 並行比較用 handoff() 交棒，在實際做事的地方用
+  profiled(handoff=...) 接手；交棒期間名額（鎖）不放掉，已回給 client 的 X-Profile-Id 一定有人接著 profile
+- 存檔失敗（磁碟滿、權限）只記 log，不影響請求本身
+"""
+from __future__ import annotations
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from chat_codec import valid_request_id
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+PROFILE_HEADER = "X-Profile"
+
+_active = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def is_admin(token: Optional[str]) -> bool:
+    if not PROFILE_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def should_profile(header_token: Optional[str]) -> bool:
+    if is_admin(header_token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _path_for(request_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{request_id}.prof")
+
+
+def start() -> Optional[cProfile.Profile]:
+    """開始 profiling；已有其他 profile（或外部 profiling 工具）在跑時回 None，不 profile"""
+    if not _active.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 3.12+：Another profiling tool is already active
+        _active.release()
+        return None
+    return profiler
+
+
+def stop(profiler: cProfile.Profile) -> None:
+    """停止但不存檔"""
+    try:
+        profiler.disable()
+    finally:
+        _active.release()
+
+
+def stop_and_save(profiler: cProfile.Profile, request_id: str) -> Optional[str]:
+    """停止並存檔；回傳檔案路徑，存不了時回 None（只記 log）"""
+    stop(profiler)
+    if not valid_request_id(request_id):
+        return None
+    path = _path_for(request_id)
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError as e:
+        print(f"[request_profiler] could not save profile {request_id}: {e}")
+        return None
+    _evict_oldest()
+    return path
+
+
+class Handoff:
+    """
+    已停掉、但仍占著 profiling 名額的 profile：交給另一個 thread 用 profiled(handoff=...) 接手
+    沒被接手（job 沒排進去、回應沒送出）時呼叫 release() 歸還名額；接手後 release() 不做事
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self._lock = threading.Lock()
+        self._held = True
+
+    def _take(self) -> bool:
+        with self._lock:
+            held, self._held = self._held, False
+            return held
+
+    def resume(self) -> Optional[cProfile.Profile]:
+        """在目前 thread 接著 profile；名額已被歸還、或外部 profiling 工具占用時回 None"""
+        if not self._take():
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            _active.release()
+            print(f"[request_profiler] could not resume profile {self.request_id}: {e}")
+            return None
+        return profiler
+
+    def release(self) -> None:
+        if self._take():
+            _active.release()
+
+
+def handoff(profiler: cProfile.Profile, request_id: str) -> Handoff:
+    """停掉目前 thread 的 profiler（不存），名額留給接手的 thread"""
+    profiler.disable()
+    return Handoff(request_id)
+
+
+@contextmanager
+def profiled(request_id: Optional[str] = None, handoff: Optional[Handoff] = None) -> Iterator[None]:
+    """
+    在目前 thread profile 一段程式，結束後存檔
+    - handoff：接手別的 thread 交棒的 profile（以它的 request ID 存檔）
+    - 只給 request_id：自己搶名額，忙碌時不 profile；兩者都沒有時不做事
+    """
+    if handoff is not None:
+        request_id = handoff.request_id
+        profiler = handoff.resume()
+    else:
+        profiler = start() if request_id else None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            stop_and_save(profiler, request_id)
+
+
+def _evict_oldest() -> None:
+    try:
+        files = [
+            os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith(".prof")
+        ]
+    except FileNotFoundError:
+        return
+    if len(files) <= PROFILE_MAX_FILES:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[: len(files) - PROFILE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load_raw(request_id: str) -> Optional[bytes]:
+    if not valid_request_id(request_id):
+        return None
+    try:
+        with open(_path_for(request_id), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def render_text(request_id: str, sort: str = "cumulative", limit: int = 40) -> Optional[str]:
+    """pstats 文字摘要（依 sort 排序，前 limit 行）"""
+    if load_raw(request_id) is None:
+        return None
+    buf = io.StringIO()
+    stats = pstats.Stats(_path_for(request_id), stream=buf)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return buf.getvalue()
@@ -0,0 +1,256 @@
+/**
+ * 🌙 Adaptive Effects Engine
+ *
+ * 管理背景櫻花 / 星星動畫的「成本」：
+ * - prefers-reduced-motion：完全不建立節點（設定改變時即時開關）
+ * - visibilitychange：分頁隱藏時暫停所有 CSS 動畫
+ * - 依實測 frame time 自動降低花瓣 / 星星數量（並關掉花瓣陰影濾鏡）
+ *
+ * 量測只在短暫的取樣窗內跑 requestAnimationFrame，平時零額外成本。
+ * 除錯：在 console 執行 window.effectsEngine.stats()
+ */
+
+class AdaptiveEffects {
+  constructor(options = {}) {
+    this.sakuraContainer = options.sakuraContainer || null;
+    this.starContainer = options.starContainer || null;
+    this.sakuraOptions = options.sakuraOptions || {};
+
+    this.config = {
+      maxPetals: options.maxPetals || 35,
+      minPetals: options.minPetals || 8,
+      maxStars: options.maxStars || 40,
+      minStars: options.minStars || 12,
+
+      // 平均 frame time 超過這個值（ms）就降級；約 45fps
+      frameBudgetMs: options.frameBudgetMs || 22,
+      // 每次取樣長度 / 兩次取樣間隔（ms）
+      sampleMs: options.sampleMs || 2000,
+      sampleIntervalMs: options.sampleIntervalMs || 15000,
+      // 每次降級保留的比例
+      downscale: options.downscale || 0.6,
+    };
+
+    this.sakura = null;
+    this.petalCount = 0;
+    this.starCount = 0;
+    this.running = false;
+    this.lite = false;
+
+    this._sampleTimer = null;
+    this._rafId = null;
+    this._lastFrameMs = null;
+    this._history = [];
+
+    this._onVisibility = this._onVisibility.bind(this);
+    this._reducedMotion = window.matchMedia
+      ? window.matchMedia('(prefers-reduced-motion: reduce)')
+      : null;
+  }
+
+  /**
+   * 啟動（若使用者偏好減少動態，只掛監聽、不建立任何節點）
+   */
+  start() {
+    if (this._reducedMotion) {
+      const onChange = () => (this._reducedMotion.matches ? this.stop() : this._run());
+      if (this._reducedMotion.addEventListener) {
+        this._reducedMotion.addEventListener('change', onChange);
+      } else if (this._reducedMotion.addListener) {
+        this._reducedMotion.addListener(onChange);
+      }
+      if (this._reducedMotion.matches) return;
+    }
+    this._run();
+  }
+
+  _run() {
+    if (this.running) return;
+    this.running = true;
+
+    // 低階裝置先從一半數量開始，之後再由量測決定
+    const lowEnd = (navigator.hardwareConcurrency || 8) <= 4 || (navigator.deviceMemory || 8) <= 2;
+    const ratio = lowEnd ? 0.5 : 1;
+
+    this._setPetals(Math.round(this.config.maxPetals * ratio));
+    this._setStars(Math.round(this.config.maxStars * ratio));
+
+    document.addEventListener('visibilitychange', this._onVisibility);
+    if (document.hidden) {
+      this.pause();
+    } else {
+      this._scheduleSample(1000);
+    }
+  }
+
+  /**
+   * 完全停止並移除節點
+   */
+  stop() {
+    this.running = false;
+    this._cancelSampling();
+    document.removeEventListener('visibilitychange', this._onVisibility);
+    if (this.sakura) this.sakura.destroy();
+    this.sakura = null;
+    if (this.sakuraContainer) this.sakuraContainer.innerHTML = '';
+    if (this.starContainer) this.starContainer.innerHTML = '';
+    // 清掉暫停 / 降級狀態，之後 _run() 重建的節點才會正常動起來
+    [this.sakuraContainer, this.starContainer].forEach((el) => el && el.classList.remove('paused', 'lite'));
+    this.lite = false;
+    this._history = [];
+    this.petalCount = 0;
+    this.starCount = 0;
+  }
+
+  pause() {
+    this._cancelSampling();
+    if (this.sakura) this.sakura.pause();
+    [this.sakuraContainer, this.starContainer].forEach((el) => el && el.classList.add('paused'));
+  }
+
+  resume() {
+    if (!this.running) return;
+    if (this.sakura) this.sakura.resume();
+    [this.sakuraContainer, this.starContainer].forEach((el) => el && el.classList.remove('paused'));
+    this._scheduleSample(1000);
+  }
+
+  _onVisibility() {
+    if (document.hidden) this.pause();
+    else this.resume();
+  }
+
+  // =========================
+  // 節點數量
+  // =========================
+  _setPetals(count) {
+    if (!this.sakuraContainer) return;
+    this.petalCount = count;
+
+    if (typeof SakuraPetal !== 'undefined') {
+      if (!this.sakura) {
+        this.sakura = new SakuraPetal(this.sakuraContainer, { ...this.sakuraOptions, count });
+      } else {
+        this.sakura.setCount(count);
+      }
+      return;
+    }
+
+    // Fallback: 使用原始方式生成 (不含 SVG)
+    const petals = this.sakuraContainer.querySelectorAll('.sakura');
+    for (let i = petals.length - 1; i >= count; i--) petals[i].remove();
+    for (let i = petals.length; i < count; i++) {
+      const petal = document.createElement('div');
+      petal.className = 'sakura';
+      petal.style.left = Math.random() * 100 + '%';
+      petal.style.animationDelay = Math.random() * 12 + 's';
+      petal.style.animationDuration = 12 + Math.random() * 8 + 's';
+      this.sakuraContainer.appendChild(petal);
+    }
+  }
+
+  _setStars(count) {
+    if (!this.starContainer) return;
+    this.starCount = count;
+
+    const stars = this.starContainer.querySelectorAll('.star');
+    for (let i = stars.length - 1; i >= count; i--) stars[i].remove();
+
+    const fragment = document.createDocumentFragment();
+    for (let i = stars.length; i < count; i++) {
+      const star = document.createElement('div');
+      star.className = 'star';
+      star.style.left = Math.random() * 100 + '%';
+      star.style.top = Math.random() * 100 + '%';
+      star.style.animationDelay = Math.random() * 4 + 's';
+      star.style.animationDuration = 3 + Math.random() * 3 + 's';
+      fragment.appendChild(star);
+    }
+    this.starContainer.appendChild(fragment);
+  }
+
+  // =========================
+  // Frame time 取樣
+  // =========================
+  _scheduleSample(delay) {
+    this._cancelSampling();
+    this._sampleTimer = setTimeout(() => this._sample(), delay);
+  }
+
+  _cancelSampling() {
+    if (this._sampleTimer) clearTimeout(this._sampleTimer);
+    if (this._rafId) cancelAnimationFrame(this._rafId);
+    this._sampleTimer = null;
+    this._rafId = null;
+  }
+
+  _sample() {
+    const deltas = [];
+    const startedAt = performance.now();
+    let last = startedAt;
+
+    const tick = (now) => {
+      deltas.push(now - last);
+      last = now;
+      if (now - startedAt < this.config.sampleMs) {
+        this._rafId = requestAnimationFrame(tick);
+        return;
+      }
+      this._rafId = null;
+      this._evaluate(deltas);
+    };
+    this._rafId = requestAnimationFrame(tick);
+  }
+
+  _evaluate(deltas) {
+    // 第一個 delta 含排程延遲，丟掉
+    const samples = deltas.slice(1);
+    if (samples.length) {
+      const avg = samples.reduce((a, b) => a + b, 0) / samples.length;
+      this._lastFrameMs = avg;
+      this._history.push({
+        at: Date.now(),
+        frameMs: Math.round(avg * 10) / 10,
+        petals: this.petalCount,
+        stars: this.starCount,
+      });
+      if (this._history.length > 20) this._history.shift();
+
+      if (avg > this.config.frameBudgetMs) this._downgrade();
+    }
+    if (this.running && !document.hidden) {
+      this._scheduleSample(this.config.sampleIntervalMs);
+    }
+  }
+
+  _downgrade() {
+    // 第一步：拿掉花瓣陰影（canvas 版換成沒有陰影的 sprite；DOM fallback 關掉 filter）
+    if (!this.lite) {
+      this.lite = true;
+      if (this.sakura) this.sakura.setLite(true);
+      if (this.sakuraContainer) this.sakuraContainer.classList.add('lite');
+      return;
+    }
+    const petals = Math.max(this.config.minPetals, Math.floor(this.petalCount * this.config.downscale));
+    const stars = Math.max(this.config.minStars, Math.floor(this.starCount * this.config.downscale));
+    if (petals < this.petalCount) this._setPetals(petals);
+    if (stars < this.starCount) this._setStars(stars);
+  }
+
+  /**
+   * 除錯用：目前節點數與最近的 frame time 取樣
+   */
+  stats() {
+    return {
+      running: this.running,
+      reducedMotion: !!(this._reducedMotion && this._reducedMotion.matches),
+      lite: this.lite,
+      petals: this.petalCount,
+      stars: this.starCount,
+      lastFrameMs: this._lastFrameMs,
+      history: this._history.slice(),
+    };
+  }
+}
+
+window.AdaptiveEffects = AdaptiveEffects;
@@ -1,21 +1,61 @@
 /**
- * 🌸 Sakura Petal Generator (Simple Version)
- * 
- * 只負責生成 SVG 花瓣形狀
- * 動畫由 CSS @keyframes sakuraFall 控制
+ * 🌸 Sakura Petal Renderer (Canvas Version)
+ *
+ * 所有花瓣畫在同一個 <canvas> 上，一個 requestAnimationFrame 迴圈：
+ * - 花瓣形狀（漸層 + 葉脈 + 陰影）依顏色 / 遠近預先畫成小 sprite，每幀只 drawImage
+ * - 落下軌跡照 CSS @keyframes sakuraFall 的關鍵影格內插（位移 / 旋轉 / 透明度）
+ * - 不再是 N 個各自帶 filter 的 div：合成層從 N 個降到 1 個，陰影不用每幀重算
+ * - 容器被隱藏（夜間主題 display:none）或 pause() 時停掉迴圈，零成本
  */
 
+// sakuraFall 關鍵影格：[進度, 值]
+const SAKURA_FALL = {
+  y: [[0, 0], [0.25, 0.25], [0.5, 0.5], [0.75, 0.75], [1, 1.1]],      // vh 比例（0% 的 -10% 花瓣高度另外加）
+  x: [[0, 0], [0.25, 15], [0.5, -10], [0.75, 25], [1, 45]],          // px
+  rotate: [[0, 0], [0.25, 90], [0.5, 180], [0.75, 270], [1, 360]],   // deg
+  opacity: [[0, 0], [0.08, 0.85], [0.5, 0.75], [0.92, 0.4], [1, 0]],
+};
+
+// 遠近分三層預畫陰影（原本每片花瓣各自的 drop-shadow / blur）
+const SAKURA_DEPTH_LEVELS = [0.15, 0.5, 0.85];
+
+const SAKURA_PETAL_PATH =
+  'M 50 115 C 25 115, 5 90, 5 60 C 5 30, 25 5, 42 5 C 46 5, 48 8, 50 15 ' +
+  'C 52 8, 54 5, 58 5 C 75 5, 95 30, 95 60 C 95 90, 75 115, 50 115 Z';
+
+function easeInOut(t) {
+  // CSS ease-in-out 的近似
+  return t < 0.5 ? 2 * t * t : 1 - Math.pow(-2 * t + 2, 2) / 2;
+}
+
+function sampleKeyframes(frames, p) {
+  for (let i = 1; i < frames.length; i++) {
+    const [p1, v1] = frames[i];
+    if (p <= p1) {
+      const [p0, v0] = frames[i - 1];
+      const t = p1 > p0 ? (p - p0) / (p1 - p0) : 1;
+      return v0 + (v1 - v0) * easeInOut(t);
+    }
+  }
+  return frames[frames.length - 1][1];
+}
+
+function hexToRgba(hex, alpha) {
+  const n = parseInt(hex.replace('#', ''), 16);
+  return `rgba(${(n >> 16) & 255}, ${(n >> 8) & 255}, ${n & 255}, ${alpha})`;
+}
+
 class SakuraPetal {
   constructor(container, config = {}) {
     this.container = container;
     this.config = {
       // 花瓣數量
       count: config.count || 35,
-      
+
       // 花瓣大小
       baseSize: config.baseSize || 16,
       sizeVariation: config.sizeVariation || 0.6,
-      
+
       // 顏色
       colors: config.colors || [
         { base: '#ffb7c5', tip: '#ffc9d4', center: '#fff0f3' },
@@ -24,217 +64,298 @@ class SakuraPetal {
         { base: '#ffd0d9', tip: '#ffe0e6', center: '#fffafb' },
         { base: '#ffccd5', tip: '#ffdde3', center: '#fff8f9' },
       ],
-      
+
       // 動畫時間範圍 (秒)
       durationMin: config.durationMin || 12,
       durationMax: config.durationMax || 20,
-      
+
       // 延遲範圍 (秒)
       delayMax: config.delayMax || 12,
-      
+
       ...config
     };
-    
+
+    this.petals = [];
+    this.lite = false;
+    this.paused = false;
+    this.visible = true;
+
+    this._rafId = null;
+    this._startedAt = null;
+    this._pausedAt = null;
+    this._lastNow = null;
+    this._sprites = null;
+    this._size = { width: 0, height: 0, dpr: 1 };
+    this._needsResize = true;
+
+    this._frame = this._frame.bind(this);
+    this._onResize = () => {
+      this._needsResize = true;
+    };
+
     this.init();
   }
-  
+
   /**
-   * 生成 SVG 花瓣 - 真實心形缺口
+   * 預先畫好每種顏色 × 遠近的花瓣 sprite（lite 模式用沒有陰影的那組）
    */
-  createPetalSVG(color, size) {
-    const svg = document.createElementNS('http://www.w3.org/2000/svg', 'svg');
-    svg.setAttribute('viewBox', '0 0 100 120');
-    svg.setAttribute('width', size);
-    svg.setAttribute('height', size * 1.2);
-    svg.style.overflow = 'visible';
-    
-    const gradientId = `petal-${Math.random().toString(36).substr(2, 9)}`;
-    const defs = document.createElementNS('http://www.w3.org/2000/svg', 'defs');
-    
-    // 徑向漸層
-    const radialGradient = document.createElementNS('http://www.w3.org/2000/svg', 'radialGradient');
-    radialGradient.setAttribute('id', gradientId);
-    radialGradient.setAttribute('cx', '30%');
-    radialGradient.setAttribute('cy', '40%');
-    radialGradient.setAttribute('r', '70%');
-    
-    const stop1 = document.createElementNS('http://www.w3.org/2000/svg', 'stop');
-    stop1.setAttribute('offset', '0%');
-    stop1.setAttribute('stop-color', color.center);
-    
-    const stop2 = document.createElementNS('http://www.w3.org/2000/svg', 'stop');
-    stop2.setAttribute('offset', '50%');
-    stop2.setAttribute('stop-color', color.tip);
-    
-    const stop3 = document.createElementNS('http://www.w3.org/2000/svg', 'stop');
-    stop3.setAttribute('offset', '100%');
-    stop3.setAttribute('stop-color', color.base);
-    
-    radialGradient.appendChild(stop1);
-    radialGradient.appendChild(stop2);
-    radialGradient.appendChild(stop3);
-    defs.appendChild(radialGradient);
-    
-    // 葉脈漸層
-    const veinGradient = document.createElementNS('http://www.w3.org/2000/svg', 'linearGradient');
-    veinGradient.setAttribute('id', `${gradientId}-vein`);
-    veinGradient.setAttribute('x1', '0%');
-    veinGradient.setAttribute('y1', '100%');
-    veinGradient.setAttribute('x2', '0%');
-    veinGradient.setAttribute('y2', '0%');
-    
-    const veinStop1 = document.createElementNS('http://www.w3.org/2000/svg', 'stop');
-    veinStop1.setAttribute('offset', '0%');
-    veinStop1.setAttribute('stop-color', color.base);
-    veinStop1.setAttribute('stop-opacity', '0.25');
-    
-    const veinStop2 = document.createElementNS('http://www.w3.org/2000/svg', 'stop');
-    veinStop2.setAttribute('offset', '100%');
-    veinStop2.setAttribute('stop-color', color.center);
-    veinStop2.setAttribute('stop-opacity', '0');
-    
-    veinGradient.appendChild(veinStop1);
-    veinGradient.appendChild(veinStop2);
-    defs.appendChild(veinGradient);
-    
-    svg.appendChild(defs);
-    
-    // 花瓣主體 - 心形缺口
-    const petalPath = document.createElementNS('http://www.w3.org/2000/svg', 'path');
-    petalPath.setAttribute('d', `
-      M 50 115
-      C 25 115, 5 90, 5 60
-      C 5 30, 25 5, 42 5
-      C 46 5, 48 8, 50 15
-      C 52 8, 54 5, 58 5
-      C 75 5, 95 30, 95 60
-      C 95 90, 75 115, 50 115
-      Z
-    `);
-    petalPath.setAttribute('fill', `url(#${gradientId})`);
-    
-    // 中心葉脈
-    const veinPath = document.createElementNS('http://www.w3.org/2000/svg', 'path');
-    veinPath.setAttribute('d', 'M 50 108 Q 50 65, 50 22');
-    veinPath.setAttribute('stroke', `url(#${gradientId}-vein)`);
-    veinPath.setAttribute('stroke-width', '2.5');
-    veinPath.setAttribute('fill', 'none');
-    veinPath.setAttribute('stroke-linecap', 'round');
-    
-    // 側邊葉脈
-    const vein2 = document.createElementNS('http://www.w3.org/2000/svg', 'path');
-    vein2.setAttribute('d', 'M 50 75 Q 32 60, 22 50');
-    vein2.setAttribute('stroke', color.base);
-    vein2.setAttribute('stroke-width', '1.2');
-    vein2.setAttribute('stroke-opacity', '0.12');
-    vein2.setAttribute('fill', 'none');
-    
-    const vein3 = document.createElementNS('http://www.w3.org/2000/svg', 'path');
-    vein3.setAttribute('d', 'M 50 75 Q 68 60, 78 50');
-    vein3.setAttribute('stroke', color.base);
-    vein3.setAttribute('stroke-width', '1.2');
-    vein3.setAttribute('stroke-opacity', '0.12');
-    vein3.setAttribute('fill', 'none');
-    
-    svg.appendChild(petalPath);
-    svg.appendChild(veinPath);
-    svg.appendChild(vein2);
-    svg.appendChild(vein3);
-    
-    return svg;
-  }
-  
+  buildSprites() {
+    const dpr = this._size.dpr;
+    const maxSize = this.config.baseSize * (0.5 + this.config.sizeVariation);
+    const pad = 10;
+    const width = Math.ceil((maxSize + pad * 2) * dpr);
+    const height = Math.ceil((maxSize * 1.2 + pad * 2) * dpr);
+    const petalPath = new Path2D(SAKURA_PETAL_PATH);
+
+    const draw = (color, depth) => {
+      const canvas = document.createElement('canvas');
+      canvas.width = width;
+      canvas.height = height;
+      const ctx = canvas.getContext('2d');
+
+      ctx.translate(width / 2, height / 2);
+      ctx.scale((maxSize * dpr) / 100, (maxSize * dpr) / 100);
+      ctx.translate(-50, -60);
+
+      if (depth !== null) {
+        // 原本的 drop-shadow(0 2px 3~6px rgba(255,183,197,0.2~0.35))，以 canvas 陰影預先畫進 sprite
+        ctx.shadowColor = `rgba(255, 183, 197, ${0.2 + depth * 0.15})`;
+        ctx.shadowBlur = (3 + depth * 3) * dpr;
+        ctx.shadowOffsetY = 2 * dpr;
+        if (depth < 0.3 && 'filter' in ctx) ctx.filter = 'blur(0.5px)';
+      }
+
+      // 花瓣主體：徑向漸層
+      const gradient = ctx.createRadialGradient(32, 49, 0, 32, 49, 70);
+      gradient.addColorStop(0, color.center);
+      gradient.addColorStop(0.5, color.tip);
+      gradient.addColorStop(1, color.base);
+      ctx.fillStyle = gradient;
+      ctx.fill(petalPath);
+
+      // 葉脈不帶陰影
+      ctx.shadowColor = 'transparent';
+      ctx.lineCap = 'round';
+
+      const vein = ctx.createLinearGradient(0, 108, 0, 22);
+      vein.addColorStop(0, hexToRgba(color.base, 0.25));
+      vein.addColorStop(1, hexToRgba(color.center, 0));
+      ctx.strokeStyle = vein;
+      ctx.lineWidth = 2.5;
+      ctx.stroke(new Path2D('M 50 108 Q 50 65, 50 22'));
+
+      ctx.strokeStyle = hexToRgba(color.base, 0.12);
+      ctx.lineWidth = 1.2;
+      ctx.stroke(new Path2D('M 50 75 Q 32 60, 22 50'));
+      ctx.stroke(new Path2D('M 50 75 Q 68 60, 78 50'));
+
+      return canvas;
+    };
+
+    this._sprites = this.config.colors.map((color) => ({
+      plain: draw(color, null),
+      shadow: SAKURA_DEPTH_LEVELS.map((depth) => draw(color, depth)),
+    }));
+    this._spriteBox = { width: width / dpr, height: height / dpr, scale: maxSize };
+  }
+
   /**
-   * 生成單片花瓣元素
+   * 生成單片花瓣的參數
    */
-  createPetal(index) {
+  createPetal() {
     const cfg = this.config;
-    
-    // 隨機大小
-    const sizeMultiplier = 0.5 + Math.random() * cfg.sizeVariation;
-    const size = cfg.baseSize * sizeMultiplier;
-    
-    // 隨機顏色
-    const color = cfg.colors[Math.floor(Math.random() * cfg.colors.length)];
-    
-    // 建立容器
-    const petal = document.createElement('div');
-    petal.className = 'sakura';
-    
-    // 隨機位置
-    petal.style.left = `${Math.random() * 100}%`;
-    
-    // 隨機動畫時間和延遲 (使用原始 CSS 動畫)
-    const duration = cfg.durationMin + Math.random() * (cfg.durationMax - cfg.durationMin);
-    const delay = Math.random() * cfg.delayMax;
-    petal.style.animationDuration = `${duration}s`;
-    petal.style.animationDelay = `${delay}s`;
-    
-    // 深度效果 (遠近)
-    const depth = Math.random();
-    const blur = depth < 0.3 ? 0.5 : 0;
-    const shadowOpacity = 0.2 + depth * 0.15;
-    
-    petal.style.filter = `
-      drop-shadow(0 2px ${3 + depth * 3}px rgba(255, 183, 197, ${shadowOpacity}))
-      ${blur > 0 ? `blur(${blur}px)` : ''}
-    `;
-    
-    // 加入 SVG 花瓣
-    const svg = this.createPetalSVG(color, size);
-    petal.appendChild(svg);
-    
-    return petal;
-  }
-  
+    return {
+      size: cfg.baseSize * (0.5 + Math.random() * cfg.sizeVariation),
+      colorIndex: Math.floor(Math.random() * cfg.colors.length),
+      left: Math.random(),
+      duration: cfg.durationMin + Math.random() * (cfg.durationMax - cfg.durationMin),
+      delay: Math.random() * cfg.delayMax,
+      depthLevel: Math.floor(Math.random() * SAKURA_DEPTH_LEVELS.length),
+    };
+  }
+
   /**
    * 初始化
    */
   init() {
-    // 清空容器
+    this.stopLoop();
     this.container.innerHTML = '';
-    
-    // 生成花瓣
-    for (let i = 0; i < this.config.count; i++) {
-      const petal = this.createPetal(i);
-      this.container.appendChild(petal);
+
+    this.canvas = document.createElement('canvas');
+    this.canvas.className = 'sakura-canvas';
+    this.canvas.setAttribute('aria-hidden', 'true');
+    this.ctx = this.canvas.getContext('2d');
+    this.container.appendChild(this.canvas);
+
+    this.petals = [];
+    for (let i = 0; i < this.config.count; i++) this.petals.push(this.createPetal());
+    this._needsResize = true;
+    this._startedAt = null;
+    this._pausedAt = null;
+    this._lastNow = null;
+
+    window.addEventListener('resize', this._onResize);
+
+    // 夜間主題把容器 display:none 時停掉迴圈
+    if (!this._observer && typeof IntersectionObserver !== 'undefined') {
+      this._observer = new IntersectionObserver((entries) => {
+        this.visible = entries[entries.length - 1].isIntersecting;
+        // 隱藏時量到的尺寸是 0，重新顯示時要重量
+        if (this.visible) this._needsResize = true;
+        this._syncLoop();
+      });
+      this._observer.observe(this.container);
+    }
+    this._syncLoop();
+  }
+
+  _resize() {
+    const dpr = Math.min(window.devicePixelRatio || 1, 2);
+    const width = this.container.clientWidth;
+    const height = this.container.clientHeight;
+    this.canvas.width = Math.round(width * dpr);
+    this.canvas.height = Math.round(height * dpr);
+    this.canvas.style.width = `${width}px`;
+    this.canvas.style.height = `${height}px`;
+    const dprChanged = dpr !== this._size.dpr;
+    this._size = { width, height, dpr };
+    if (!this._sprites || dprChanged) this.buildSprites();
+    this._needsResize = false;
+  }
+
+  // =========================
+  // 繪製迴圈
+  // =========================
+  _syncLoop() {
+    if (!this.paused && this.visible && this.canvas) {
+      if (this._rafId === null) this._rafId = requestAnimationFrame(this._frame);
+    } else {
+      this.stopLoop();
+    }
+  }
+
+  stopLoop() {
+    if (this._rafId !== null) {
+      cancelAnimationFrame(this._rafId);
+      // 停止期間時間不前進（與 CSS animation-play-state: paused 一致）
+      if (this._lastNow !== null) this._pausedAt = this._lastNow;
+    }
+    this._rafId = null;
+  }
+
+  _frame(now) {
+    this._rafId = requestAnimationFrame(this._frame);
+    if (this._needsResize) this._resize();
+    if (this._startedAt === null) this._startedAt = now;
+    if (this._pausedAt !== null) {
+      this._startedAt += now - this._pausedAt;
+      this._pausedAt = null;
+    }
+    this._lastNow = now;
+    const elapsed = (now - this._startedAt) / 1000;
+
+    const { width, height, dpr } = this._size;
+    const ctx = this.ctx;
+    ctx.setTransform(1, 0, 0, 1, 0, 0);
+    ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
+
+    const box = this._spriteBox;
+    for (const petal of this.petals) {
+      const t = elapsed - petal.delay;
+      if (t < 0) continue;
+      const p = (t / petal.duration) % 1;
+      const opacity = sampleKeyframes(SAKURA_FALL.opacity, p);
+      if (opacity <= 0.01) continue;
+
+      const scale = petal.size / box.scale;
+      const petalHeight = petal.size * 1.2;
+      // 0% 影格是 translateY(-10%)（相對花瓣本身），其他影格是 vh
+      let y = height * sampleKeyframes(SAKURA_FALL.y, p);
+      if (p < 0.25) y -= petalHeight * 0.1 * (1 - easeInOut(p / 0.25));
+      const x = petal.left * width + sampleKeyframes(SAKURA_FALL.x, p);
+      const angle = (sampleKeyframes(SAKURA_FALL.rotate, p) * Math.PI) / 180;
+
+      const set = this._sprites[petal.colorIndex % this._sprites.length];
+      const sprite = this.lite ? set.plain : set.shadow[petal.depthLevel];
+
+      ctx.globalAlpha = opacity;
+      ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+      // 以花瓣中心旋轉（CSS transform-origin: center）
+      ctx.translate(x + petal.size / 2, y + petalHeight / 2);
+      ctx.rotate(angle);
+      ctx.scale(scale, scale);
+      ctx.drawImage(sprite, -box.width / 2, -box.height / 2, box.width, box.height);
+    }
+    ctx.globalAlpha = 1;
+  }
+
+  /**
+   * 調整花瓣數量（只增減差額，不重建全部）
+   */
+  setCount(count) {
+    const target = Math.max(0, Math.round(count));
+    this.config.count = target;
+    if (this.petals.length > target) {
+      this.petals.length = target;
+    } else {
+      while (this.petals.length < target) this.petals.push(this.createPetal());
     }
   }
-  
+
+  /**
+   * 降級：改用沒有陰影 / 模糊的 sprite
+   */
+  setLite(lite) {
+    this.lite = !!lite;
+  }
+
   /**
    * 重新生成
    */
   regenerate() {
+    this._sprites = null;
     this.init();
   }
-  
+
   /**
    * 更新設定
    */
   setConfig(newConfig) {
     this.config = { ...this.config, ...newConfig };
+    this._sprites = null;
+    this._needsResize = true;
   }
-  
+
   /**
-   * 暫停 (透過 CSS class)
+   * 暫停（停掉繪製迴圈）
    */
   pause() {
+    this.paused = true;
     this.container.classList.add('paused');
+    this._syncLoop();
   }
-  
+
   /**
    * 恢復
    */
   resume() {
+    this.paused = false;
     this.container.classList.remove('paused');
+    this._syncLoop();
   }
-  
+
   /**
    * 清除
    */
   destroy() {
+    this.stopLoop();
+    window.removeEventListener('resize', this._onResize);
+    if (this._observer) this._observer.disconnect();
+    this._observer = null;
+    this.canvas = null;
+    this.petals = [];
     this.container.innerHTML = '';
   }
 }
 
-window.SakuraPetal = SakuraPetal;
\ No newline at end of file
+window.SakuraPetal = SakuraPetal;
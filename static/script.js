@@ -14,14 +14,15 @@ const themeIcon = themeToggle ? themeToggle.querySelector(".theme-icon") : null;
 const html = document.documentElement;
 
 // =========================
-// 🌸 Sakura Animation Instance
+// 🌸 Effects Engine Instance（櫻花 + 星星）
 // =========================
-let sakuraAnimation = null;
+let effectsEngine = null;
 
 // =========================
 // LocalStorage：歷史訊息
 // =========================
 let messages = loadMessages();
+let sessionId = loadSessionId();
 renderAllMessages();
 
 // =========================
@@ -51,6 +52,8 @@ if (clearBtn) {
 
     messages = [];
     saveMessages();
+    clearPending();
+    sessionId = resetSessionId();
     renderAllMessages();
 
     if (statusText) {
@@ -77,42 +80,162 @@ function handleSend() {
   appendMessageToUI(userMsg);
 
   inputEl.value = "";
-  callBackend(mode);
+  callBackend(mode, newSessionId());
 }
 
 // =========================
-// 呼叫後端 /api/chat
+// 呼叫後端 /api/chat/jobs（送出後 long-poll 取結果）
+// - 每則訊息一個 request_id；斷線重試時沿用，後端會直接給暫存的回覆
+// - 拿到 job_id 就記進 pending：重新整理 / 重連後先接著等同一個 job，job 不在了才重送
 // =========================
-function callBackend(mode) {
+const JOB_POLL_WAIT_S = 8;       // 每次 long-poll 最多等幾秒（伺服器上限 JOB_MAX_WAIT_S）
+const JOB_MAX_TOTAL_MS = 180000; // 整體最多等多久
+const RESUME_MAX_ATTEMPTS = 3;   // 斷線後最多重連幾次
+
+function callBackend(mode, requestId, jobId) {
   if (sendBtn) sendBtn.disabled = true;
   if (statusText) statusText.textContent = "思考中…";
+  const pending = { mode, requestId, jobId: jobId || null };
+  savePending(pending);
 
-  fetch("/api/chat", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ mode, messages }),
-  })
-    .then((res) => res.json())
-    .then((data) => {
-      const replyText = data.reply || "（沒有收到回覆）";
-      const botMsg = { role: "assistant", content: replyText };
+  requestReply(pending, { text: "" }, 0)
+    .then((replyText) => {
+      const botMsg = { role: "assistant", content: replyText || "（沒有收到回覆）" };
       messages.push(botMsg);
       saveMessages();
       appendMessageToUI(botMsg);
     })
     .catch((err) => {
       console.error(err);
-      const errMsg = { role: "assistant", content: "發生錯誤，稍後再試一次。" };
+      const content =
+        err && err.message === "busy"
+          ? "現在有點忙碌，請稍等幾秒再試一次。"
+          : "發生錯誤，稍後再試一次。";
+      const errMsg = { role: "assistant", content };
       messages.push(errMsg);
       saveMessages();
       appendMessageToUI(errMsg);
     })
     .finally(() => {
+      clearPending();
       if (sendBtn) sendBtn.disabled = false;
       if (statusText) statusText.textContent = "";
     });
 }
 
+function requestReply(pending, received, attempt) {
+  // 已經有 job_id（之前送出過）就先等它；job 過期 / 不在了才用同一個 request_id 重送
+  const reply = pending.jobId
+    ? pollJob(pending.jobId, Date.now()).then((job) => (job ? job.reply : submitJob(pending)))
+    : submitJob(pending);
+
+  return reply.catch((err) => {
+    if ((err && err.message === "busy") || attempt >= RESUME_MAX_ATTEMPTS) throw err;
+
+    // 連線中斷：先向後端拿暫存的回覆，沒有才接著等 job / 重送
+    if (statusText) statusText.textContent = "連線中斷，重新連線中…";
+    return sleep(1000 * (attempt + 1))
+      .then(() => resumeReply(pending.requestId, received))
+      .catch(() => null)
+      .then((text) => (text !== null ? text : requestReply(pending, received, attempt + 1)));
+  });
+}
+
+function submitJob(pending) {
+  return fetch("/api/chat/jobs", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      mode: pending.mode,
+      messages,
+      session_id: sessionId,
+      request_id: pending.requestId,
+    }),
+  })
+    .then((res) => {
+      if (res.status === 503) throw new Error("busy");
+      return res.json();
+    })
+    .then((data) => {
+      if (!data.job_id) throw new Error(data.error || "no job id");
+      pending.jobId = data.job_id;
+      savePending(pending);
+      return pollJob(data.job_id, Date.now());
+    })
+    .then((job) => {
+      if (!job) throw new Error("job failed");
+      return job.reply;
+    });
+}
+
+// job 已過期 / 不存在 / 失敗時回傳 null（呼叫端改用同一個 request_id 重送）
+function pollJob(jobId, startedAt) {
+  return fetch(`/api/chat/jobs/${encodeURIComponent(jobId)}?wait=${JOB_POLL_WAIT_S}`)
+    .then((res) => (res.status === 404 ? null : res.json()))
+    .then((job) => {
+      if (job === null || job.status === "failed") return null;
+      if (job.status === "done") return job;
+      if (job.error) throw new Error(job.error);
+      if (Date.now() - startedAt > JOB_MAX_TOTAL_MS) throw new Error("job timeout");
+      return pollJob(jobId, startedAt);
+    });
+}
+
+// 從已收到的 offset 繼續拿；回傳完整文字，後端沒有暫存則回傳 null
+function resumeReply(requestId, received) {
+  const url =
+    `/api/chat/replies/${encodeURIComponent(requestId)}` +
+    `?offset=${received.text.length}&wait=${JOB_POLL_WAIT_S}`;
+  // 暫存回覆只給同一個 session 讀
+  return fetch(url, { headers: { "X-Session-ID": sessionId } }).then((res) => {
+    if (res.status === 404) return null;
+    return res.json().then((data) => {
+      received.text += data.text || "";
+      if (data.status === "done") return received.text;
+      return resumeReply(requestId, received);
+    });
+  });
+}
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+// 進行中的請求（重新整理頁面後可接續）
+function savePending(pending) {
+  try {
+    localStorage.setItem("therapy_pending", JSON.stringify(pending));
+  } catch (e) {
+    console.warn("Cannot save pending request", e);
+  }
+}
+
+function clearPending() {
+  try {
+    localStorage.removeItem("therapy_pending");
+  } catch (e) {
+    console.warn("Cannot clear pending request", e);
+  }
+}
+
+function resumePendingRequest() {
+  let pending = null;
+  try {
+    pending = JSON.parse(localStorage.getItem("therapy_pending") || "null");
+  } catch (e) {
+    pending = null;
+  }
+  if (!pending || !pending.requestId) return;
+
+  // 只有最後一則還是使用者訊息時才需要接續
+  const last = messages[messages.length - 1];
+  if (!last || last.role !== "user") {
+    clearPending();
+    return;
+  }
+  callBackend(pending.mode || "support", pending.requestId, pending.jobId);
+}
+
 // =========================
 // UI 渲染
 // =========================
@@ -160,6 +283,34 @@ function loadMessages() {
   }
 }
 
+// =========================
+// Session ID（只用於後端用量統計，清除對話時換新）
+// =========================
+function newSessionId() {
+  if (window.crypto && typeof window.crypto.randomUUID === "function") {
+    return window.crypto.randomUUID();
+  }
+  return Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+}
+
+function resetSessionId() {
+  const id = newSessionId();
+  try {
+    localStorage.setItem("therapy_session_id", id);
+  } catch (e) {
+    console.warn("Cannot save session id", e);
+  }
+  return id;
+}
+
+function loadSessionId() {
+  try {
+    return localStorage.getItem("therapy_session_id") || resetSessionId();
+  } catch (e) {
+    return newSessionId();
+  }
+}
+
 // =========================
 // 模式提示：三種 mode 專屬 placeholder/hint
 // =========================
@@ -206,23 +357,30 @@ function updateModeUI(mode) {
 })();
 
 // =========================
-// 🌸 櫻花初始化 (SVG 花瓣 + CSS 動畫)
+// 🌸⭐ 背景動畫初始化（櫻花 SVG 花瓣 + 星星，交給 AdaptiveEffects 控制成本）
 // =========================
-function initSakuraAnimation() {
+function initBackgroundEffects() {
   const sakuraContainer = document.querySelector(".sakura-container");
-  if (!sakuraContainer) return;
-  
-  // 檢查是否有 SakuraPetal class
-  if (typeof SakuraPetal !== "undefined") {
-    // 使用新的 SVG 花瓣生成器
-    sakuraAnimation = new SakuraPetal(sakuraContainer, {
-      count: 35,              // 花瓣數量
+  const starContainer = document.querySelector(".star-container");
+  if (!sakuraContainer && !starContainer) return;
+
+  if (typeof AdaptiveEffects === "undefined") {
+    console.warn("AdaptiveEffects not loaded, background effects disabled");
+    return;
+  }
+
+  effectsEngine = new AdaptiveEffects({
+    sakuraContainer,
+    starContainer,
+    maxPetals: 35,            // 花瓣數量上限
+    maxStars: 40,             // 星星數量上限
+    sakuraOptions: {
       baseSize: 16,           // 基礎大小
       sizeVariation: 0.6,     // 大小變化
       durationMin: 12,        // 最短動畫時間
       durationMax: 20,        // 最長動畫時間
       delayMax: 12,           // 最大延遲
-      
+
       // 自訂顏色
       colors: [
         { base: '#ffb7c5', tip: '#ffc9d4', center: '#fff0f3' },
@@ -230,46 +388,18 @@ function initSakuraAnimation() {
         { base: '#ffaabb', tip: '#ffbfcc', center: '#ffe8ed' },
         { base: '#ffd0d9', tip: '#ffe0e6', center: '#fffafb' },
       ]
-    });
-  } else {
-    // Fallback: 使用原始方式生成 (不含 SVG)
-    console.warn("SakuraPetal not loaded, using fallback");
-    for (let i = 0; i < 35; i++) {
-      const petal = document.createElement("div");
-      petal.className = "sakura";
-      petal.style.left = Math.random() * 100 + "%";
-      petal.style.animationDelay = Math.random() * 12 + "s";
-      petal.style.animationDuration = 12 + Math.random() * 8 + "s";
-      sakuraContainer.appendChild(petal);
     }
-  }
-}
-
-// =========================
-// ⭐ 星星生成
-// =========================
-function initStars() {
-  const starContainer = document.querySelector(".star-container");
-  if (!starContainer) return;
-
-  for (let i = 0; i < 40; i++) {
-    const star = document.createElement("div");
-    star.className = "star";
-    star.style.left = Math.random() * 100 + "%";
-    star.style.top = Math.random() * 100 + "%";
-    star.style.animationDelay = Math.random() * 4 + "s";
-    star.style.animationDuration = 3 + Math.random() * 3 + "s";
-    starContainer.appendChild(star);
-  }
+  });
+  window.effectsEngine = effectsEngine;
+  effectsEngine.start();
 }
 
 // =========================
 // DOMContentLoaded: 初始化動畫
 // =========================
 document.addEventListener("DOMContentLoaded", () => {
-  // 初始化櫻花
-  initSakuraAnimation();
-  
-  // 初始化星星
-  initStars();
+  initBackgroundEffects();
+
+  // 上次送出後頁面被關掉 / 重新整理：接續拿回覆
+  resumePendingRequest();
 });
\ No newline at end of file
@@ -0,0 +1,217 @@
+# upstream_guard.py
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import openai
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+
+# 單一請求端到端的時間預算（秒），涵蓋所有重試
+REQUEST_DEADLINE_S = float(os.getenv("LLM_REQUEST_DEADLINE_S", "30"))
+
+# 每次上游呼叫至少保留的時間（秒）；本地限流等待不能吃掉這段（最多保留 deadline 的一半）
+MIN_CALL_S = float(os.getenv("LLM_MIN_CALL_S", "5"))
+
+# 可重試錯誤的最多重試次數（不含第一次呼叫）
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# 退避（full jitter）：sleep = uniform(0, min(cap, base * 2**attempt))
+BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+BACKOFF_CAP_S = float(os.getenv("LLM_BACKOFF_CAP_S", "4"))
+
+# 斷路器：在 window 秒內至少 min_calls 次呼叫、失敗率 >= threshold 就跳開
+BREAKER_WINDOW_S = float(os.getenv("LLM_BREAKER_WINDOW_S", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+
+
+# =========================
+# Deadline
+# =========================
+class Deadline:
+    """
+    端到端時間預算：在請求入口建立，一路往下傳到上游呼叫，
+    每次呼叫只能用「剩下的時間」當 timeout。
+    """
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE_S):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+# =========================
+# Retry policy
+# =========================
+_RETRYABLE_STATUS = {408, 409, 429}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    只有「上游暫時性」錯誤值得重試：逾時、連線失敗、429、5xx。
+    參數錯誤 / 認證錯誤重試也沒用，直接回報。
+    """
+    if isinstance(exc, openai.APIConnectionError):  # 含 APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        status = getattr(exc, "status_code", 0) or 0
+        return status in _RETRYABLE_STATUS or status >= 500
+    return False
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff（attempt 從 0 開始）"""
+    return random.uniform(0.0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+# =========================
+# Circuit breaker
+# =========================
+class CircuitBreaker:
+    """
+    滑動時間窗失敗率斷路器：
+    - closed：正常放行，記錄成功/失敗
+    - open：失敗率過高，cooldown 期間直接 fail fast
+    - half_open：cooldown 結束後只放一個探測請求，成功就關閉、失敗再打開
+    """
+
+    def __init__(
+        self,
+        window_s: float = BREAKER_WINDOW_S,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        cooldown_s: float = BREAKER_COOLDOWN_S,
+    ):
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_s = cooldown_s
+
+        self._lock = threading.Lock()
+        self._events: Deque[Tuple[float, bool]] = deque()
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._times_opened = 0
+        self._rejected = 0
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_s
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == "open":
+                if now - self._opened_at < self.cooldown_s:
+                    self._rejected += 1
+                    return False
+                self._state = "half_open"
+                self._probe_in_flight = False
+
+            if self._state == "half_open":
+                if self._probe_in_flight:
+                    self._rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == "half_open":
+                self._state = "closed"
+                self._events.clear()
+                self._probe_in_flight = False
+            self._events.append((now, True))
+            self._prune(now)
+
+    def release(self) -> None:
+        """
+        放行後沒有得到「上游健康度」結論（例如參數錯誤、本地限流）：
+        不記成功/失敗，只把 half_open 的探測名額還回去
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == "half_open":
+                self._trip(now)
+                return
+            self._events.append((now, False))
+            self._prune(now)
+            total = len(self._events)
+            failures = sum(1 for _, ok in self._events if not ok)
+            if total >= self.min_calls and failures / total >= self.failure_rate:
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self._state = "open"
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._times_opened += 1
+        self._events.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            total = len(self._events)
+            failures = sum(1 for _, ok in self._events if not ok)
+            retry_in: Optional[float] = None
+            if self._state == "open":
+                retry_in = round(max(0.0, self.cooldown_s - (now - self._opened_at)), 3)
+            return {
+                "state": self._state,
+                "window_calls": total,
+                "window_failures": failures,
+                "times_opened": self._times_opened,
+                "rejected": self._rejected,
+                "retry_in_s": retry_in,
+            }
+
+
+# =========================
+# 監控計數
+# =========================
+class UpstreamStats:
+    """呼叫 / 重試 / 失敗計數（thread-safe），提供給監控端點讀取"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {
+            "calls": 0,
+            "successes": 0,
+            "retries": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "fallbacks": 0,
+            "throttled": 0,
+            "governor_rejected": 0,
+        }
+
+    def incr(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + n
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
@@ -0,0 +1,244 @@
+# upstream_pool.py
+"""
+多個 OpenAI 相容 endpoint 的連線池（多組 key / project、或自架相容伺服器）
+- 設定：OPENAI_ENDPOINTS（JSON list）；沒設就只用 OPENAI_API_KEY 一組
+    例：[{"name": "main", "api_key_env": "OPENAI_API_KEY"},
+         {"name": "backup", "api_key_env": "OPENAI_API_KEY_2", "project": "proj_xxx"},
+         {"name": "local", "base_url": "http://127.0.0.1:8000/v1", "api_key": "none", "model": "qwen2.5"}]
+- 選擇：滾動延遲（EWMA）× 進行中請求數 × 錯誤率，分數最低者優先
+    還沒量過延遲的 endpoint 以「目前最快的延遲」代入（錯誤率照樣加權），同一時間只放一個探測請求
+- 錯誤太多就暫時剔除（ejection）；剔除期滿且背景健康檢查通過才恢復
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from openai import OpenAI
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+POOL_EWMA_ALPHA = float(os.getenv("POOL_EWMA_ALPHA", "0.3"))
+
+# 連續失敗 N 次、或（樣本夠多時）錯誤率超過門檻就剔除
+POOL_EJECT_CONSECUTIVE = int(os.getenv("POOL_EJECT_CONSECUTIVE", "3"))
+POOL_EJECT_ERROR_RATE = float(os.getenv("POOL_EJECT_ERROR_RATE", "0.5"))
+POOL_EJECT_MIN_SAMPLES = int(os.getenv("POOL_EJECT_MIN_SAMPLES", "10"))
+
+# 剔除時間：每次再被剔除就加倍，上限 max
+POOL_EJECT_BASE_S = float(os.getenv("POOL_EJECT_BASE_S", "30"))
+POOL_EJECT_MAX_S = float(os.getenv("POOL_EJECT_MAX_S", "300"))
+
+# 完全沒有延遲資料時的假設值（例如剛啟動、全部都還沒量過）
+POOL_UNMEASURED_LATENCY_MS = float(os.getenv("POOL_UNMEASURED_LATENCY_MS", "1000"))
+
+# 健康檢查間隔 / 單次逾時
+POOL_HEALTH_INTERVAL_S = float(os.getenv("POOL_HEALTH_INTERVAL_S", "10"))
+POOL_HEALTH_TIMEOUT_S = float(os.getenv("POOL_HEALTH_TIMEOUT_S", "5"))
+
+
+class Endpoint:
+    """單一上游 endpoint 與它的滾動統計"""
+
+    def __init__(self, name: str, client: OpenAI, model: Optional[str] = None):
+        self.name = name
+        self.client = client
+        self.model = model
+
+        self.latency_ms: Optional[float] = None  # EWMA
+        self.error_rate = 0.0                    # EWMA（0~1）
+        self.samples = 0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.times_ejected = 0
+
+    def is_ejected(self) -> bool:
+        # 剔除期滿也不會自動回來，要等健康檢查通過（_recover 才把 ejected_until 歸零）
+        return self.ejected_until > 0
+
+    def score(self, assumed_latency_ms: float = POOL_UNMEASURED_LATENCY_MS) -> float:
+        # 還沒量過的用 assumed_latency_ms 代入：錯誤率與進行中請求數照樣加權
+        latency = self.latency_ms if self.latency_ms is not None else assumed_latency_ms
+        return latency * (1 + self.in_flight) * (1 + 4 * self.error_rate)
+
+    def probing(self) -> bool:
+        """沒有延遲資料、而且已經有一個請求在路上（等它回來再決定要不要放更多）"""
+        return self.latency_ms is None and self.in_flight > 0
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "samples": self.samples,
+            "in_flight": self.in_flight,
+            "ejected": self.is_ejected(),
+            "ejected_for_s": round(max(0.0, self.ejected_until - now), 1),
+            "times_ejected": self.times_ejected,
+        }
+
+
+def _endpoint_from_config(cfg: Dict[str, Any], index: int) -> Endpoint:
+    api_key = cfg.get("api_key") or os.getenv(cfg.get("api_key_env") or "OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError(f"OPENAI_ENDPOINTS[{index}] has no api_key / api_key_env")
+    client = OpenAI(
+        api_key=api_key,
+        base_url=cfg.get("base_url") or None,
+        organization=cfg.get("organization") or None,
+        project=cfg.get("project") or None,
+        # 重試由 generate_reply 自行控制
+        max_retries=0,
+    )
+    return Endpoint(name=cfg.get("name") or f"endpoint-{index}", client=client, model=cfg.get("model"))
+
+
+def load_endpoints(default_api_key: Optional[str]) -> List[Endpoint]:
+    raw = os.getenv("OPENAI_ENDPOINTS", "").strip()
+    if not raw:
+        if not default_api_key:
+            raise RuntimeError("OPENAI_API_KEY not found. Set it in environment or .env")
+        return [Endpoint(name="default", client=OpenAI(api_key=default_api_key, max_retries=0))]
+
+    try:
+        configs = json.loads(raw)
+    except ValueError as e:
+        raise RuntimeError(f"OPENAI_ENDPOINTS is not valid JSON: {e}") from e
+    if not isinstance(configs, list) or not configs:
+        raise RuntimeError("OPENAI_ENDPOINTS must be a non-empty JSON list")
+    return [_endpoint_from_config(cfg, i) for i, cfg in enumerate(configs)]
+
+
+class UpstreamPool:
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("UpstreamPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    # ---------- 選擇 ----------
+    def acquire(self, exclude: Optional[set] = None) -> Endpoint:
+        """
+        挑分數最低的健康 endpoint（並把 in_flight +1；用完務必呼叫 release）
+        - exclude：這次請求已失敗過的 endpoint 名稱，重試時盡量換一個
+        - 沒量過延遲的 endpoint 同時只放一個請求；其他 endpoint 都不能用時才例外
+        - 全部都被剔除時，挑最快解除剔除的那個，不讓請求直接失敗
+        """
+        exclude = exclude or set()
+        with self._lock:
+            healthy = [e for e in self.endpoints if not e.is_ejected()]
+            candidates = [e for e in healthy if e.name not in exclude] or healthy
+            candidates = [e for e in candidates if not e.probing()] or candidates
+            if candidates:
+                measured = [e.latency_ms for e in self.endpoints if e.latency_ms is not None]
+                assumed = min(measured) if measured else POOL_UNMEASURED_LATENCY_MS
+                chosen = min(candidates, key=lambda e: e.score(assumed))
+            else:
+                chosen = min(self.endpoints, key=lambda e: e.ejected_until)
+            chosen.in_flight += 1
+        if len(healthy) < len(self.endpoints):
+            self._ensure_health_checker()
+        return chosen
+
+    def release(self, endpoint: Endpoint, latency_ms: Optional[float], ok: bool) -> None:
+        """
+        回報結果：ok=True 更新延遲；ok=False 記錯誤（latency_ms 可為 None）
+        只有上游健康度相關的錯誤（逾時 / 連線 / 429 / 5xx）才該用 ok=False
+        """
+        with self._lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            endpoint.samples += 1
+            a = POOL_EWMA_ALPHA
+            endpoint.error_rate = (1 - a) * endpoint.error_rate + a * (0.0 if ok else 1.0)
+
+            if ok:
+                endpoint.consecutive_failures = 0
+                if latency_ms is not None:
+                    endpoint.latency_ms = (
+                        latency_ms if endpoint.latency_ms is None
+                        else (1 - a) * endpoint.latency_ms + a * latency_ms
+                    )
+                return
+
+            endpoint.consecutive_failures += 1
+            too_many = endpoint.consecutive_failures >= POOL_EJECT_CONSECUTIVE
+            too_often = (
+                endpoint.samples >= POOL_EJECT_MIN_SAMPLES
+                and endpoint.error_rate >= POOL_EJECT_ERROR_RATE
+            )
+            # 只剩它一個健康的時候不剔除（剔除也沒有別人可用）
+            others = [
+                e for e in self.endpoints
+                if e is not endpoint and not e.is_ejected()
+            ]
+            if (too_many or too_often) and others:
+                self._eject(endpoint)
+
+    def cancel(self, endpoint: Endpoint) -> None:
+        """沒有健康度結論（例如參數錯誤）：只扣回 in_flight"""
+        with self._lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+
+    def _eject(self, endpoint: Endpoint) -> None:
+        duration = min(POOL_EJECT_MAX_S, POOL_EJECT_BASE_S * (2 ** endpoint.times_ejected))
+        endpoint.ejected_until = time.monotonic() + duration
+        endpoint.times_ejected += 1
+        endpoint.consecutive_failures = 0
+        print(f"[upstream_pool] ejected {endpoint.name} for {duration:.0f}s")
+
+    def _recover(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.ejected_until = 0.0
+            endpoint.error_rate = 0.0
+            endpoint.consecutive_failures = 0
+            # 延遲重新量，不沿用剔除前的數字
+            endpoint.latency_ms = None
+        print(f"[upstream_pool] recovered {endpoint.name}")
+
+    # ---------- 健康檢查 ----------
+    def _ensure_health_checker(self) -> None:
+        if self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name="upstream-health", daemon=True)
+            self._health_thread.start()
+
+    def check(self, endpoint: Endpoint) -> bool:
+        """輕量探測：GET /models（OpenAI 相容伺服器都支援）"""
+        try:
+            endpoint.client.with_options(timeout=POOL_HEALTH_TIMEOUT_S).models.list()
+            return True
+        except Exception:
+            return False
+
+    def _health_loop(self) -> None:
+        while True:
+            time.sleep(POOL_HEALTH_INTERVAL_S)
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                # 剔除期滿才探測：剔除時間每次加倍的意義在這裡；探測失敗就再延一輪
+                if not endpoint.is_ejected() or now < endpoint.ejected_until:
+                    continue
+                if self.check(endpoint):
+                    self._recover(endpoint)
+                else:
+                    with self._lock:
+                        self._eject(endpoint)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            return [e.snapshot(now) for e in self.endpoints]
@@ -0,0 +1,333 @@
+# usage_ledger.py
+"""
+Token / 成本帳本：
+- 每次上游呼叫把 response.usage 記成一筆（session / mode / submode / model / tokens / 耗時）
+- 先累積在記憶體，背景執行緒定期批次寫進本機 SQLite（多個 gunicorn worker 共用同一個檔案）
+- 查詢：python usage_ledger.py top-sessions | cost-by-mode | tokens-over-time | variants
+- source 區分一般聊天（chat）與臨床端並排比較（compare）：
+  cost-by-mode 兩者分列；top-sessions / tokens-over-time / variants 只看 chat（舊資料沒有 source 視為 chat）
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+# =========================
+# 設定（環境變數可覆寫）
+# =========================
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage_ledger.sqlite3")
+USAGE_FLUSH_S = float(os.getenv("USAGE_FLUSH_S", "30"))
+
+# 每百萬 tokens 的美元價格：(input, cached input, output)
+# 沒列到的模型用 default；實際價格請以官方價目表為準
+MODEL_PRICES_PER_M: Dict[str, tuple] = {
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "default": (
+        float(os.getenv("USAGE_PRICE_INPUT_PER_M", "0.40")),
+        float(os.getenv("USAGE_PRICE_CACHED_PER_M", "0.10")),
+        float(os.getenv("USAGE_PRICE_OUTPUT_PER_M", "1.60")),
+    ),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    ts REAL NOT NULL,
+    session_id TEXT,
+    mode TEXT NOT NULL,
+    submode TEXT,
+    model TEXT NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    wall_ms REAL NOT NULL,
+    variant TEXT,
+    reply_chars INTEGER,
+    length_ok INTEGER,
+    source TEXT
+)
+"""
+
+# 舊版資料庫沒有的欄位：連線時自動補上
+_ADDED_COLUMNS = {
+    "variant": "TEXT",
+    "reply_chars": "INTEGER",
+    "length_ok": "INTEGER",
+    "source": "TEXT",
+}
+
+_COLUMNS = (
+    "ts", "session_id", "mode", "submode", "model",
+    "input_tokens", "cached_tokens", "output_tokens", "wall_ms",
+    "variant", "reply_chars", "length_ok", "source",
+)
+
+
+def estimate_cost(model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """美元估算；cached tokens 是 input tokens 的子集合，用較低單價計"""
+    p_in, p_cached, p_out = MODEL_PRICES_PER_M.get(model, MODEL_PRICES_PER_M["default"])
+    uncached = max(0, input_tokens - cached_tokens)
+    return (uncached * p_in + cached_tokens * p_cached + output_tokens * p_out) / 1_000_000
+
+
+def usage_from_response(response: Any) -> Dict[str, int]:
+    """
+    從 Responses API 的 response.usage 取出 tokens（欄位缺漏時補 0）
+    也相容 chat.completions 的 prompt_tokens / completion_tokens
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+    input_tokens = getattr(usage, "input_tokens", None)
+    if input_tokens is None:
+        input_tokens = getattr(usage, "prompt_tokens", 0)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if output_tokens is None:
+        output_tokens = getattr(usage, "completion_tokens", 0)
+
+    details = getattr(usage, "input_tokens_details", None) or getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) if details is not None else 0
+
+    return {
+        "input_tokens": int(input_tokens or 0),
+        "cached_tokens": int(cached_tokens or 0),
+        "output_tokens": int(output_tokens or 0),
+    }
+
+
+# =========================
+# Ledger
+# =========================
+class UsageLedger:
+    """
+    記憶體內累積 + 定期 flush 到 SQLite
+    - record() 只做 append（持鎖很短），不在請求路徑上碰磁碟
+    - 背景 daemon thread 每 flush_s 秒批次寫入；程式結束時 atexit 再 flush 一次
+    """
+
+    def __init__(self, db_path: str = USAGE_DB_PATH, flush_s: float = USAGE_FLUSH_S):
+        self.db_path = db_path
+        self.flush_s = flush_s
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- 寫入 ----------
+    def record(
+        self,
+        *,
+        mode: str,
+        model: str,
+        input_tokens: int,
+        cached_tokens: int,
+        output_tokens: int,
+        wall_ms: float,
+        session_id: Optional[str] = None,
+        submode: Optional[str] = None,
+        variant: Optional[str] = None,
+        reply_chars: Optional[int] = None,
+        length_ok: Optional[bool] = None,
+        source: str = "chat",
+    ) -> None:
+        row = (
+            time.time(), session_id, mode, submode, model,
+            input_tokens, cached_tokens, output_tokens, wall_ms,
+            variant, reply_chars, None if length_ok is None else int(length_ok), source,
+        )
+        with self._lock:
+            self._pending.append(row)
+            t = self._totals.setdefault(
+                mode,
+                {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "cost_usd": 0.0},
+            )
+            t["calls"] += 1
+            t["input_tokens"] += input_tokens
+            t["cached_tokens"] += cached_tokens
+            t["output_tokens"] += output_tokens
+            t["cost_usd"] += estimate_cost(model, input_tokens, cached_tokens, output_tokens)
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._flush_loop, name="usage-ledger-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_s)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[usage_ledger] flush failed: {e}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute(_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(usage)")}
+        for name, col_type in _ADDED_COLUMNS.items():
+            if name not in existing:
+                try:
+                    conn.execute(f"ALTER TABLE usage ADD COLUMN {name} {col_type}")
+                except sqlite3.OperationalError:
+                    pass  # 別的 worker 剛好先補上了
+        return conn
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO usage ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    rows,
+                )
+            conn.close()
+        except sqlite3.Error:
+            # 寫失敗就放回去，下次再試
+            with self._lock:
+                self._pending[:0] = rows
+            raise
+        return len(rows)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """本 process 自啟動以來、依 mode 彙總的用量（尚未含其他 worker）"""
+        with self._lock:
+            return {mode: dict(t) for mode, t in self._totals.items()}
+
+    # ---------- 查詢（讀 SQLite，涵蓋所有 worker） ----------
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        conn.create_function("cost", 4, estimate_cost)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def top_sessions(self, limit: int = 10, since: float = 0.0) -> List[Dict[str, Any]]:
+        rows = self._query(
+            """
+            SELECT session_id, COUNT(*) AS turns,
+                   SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens,
+                   SUM(cost(model, input_tokens, cached_tokens, output_tokens)) AS cost_usd,
+                   AVG(wall_ms) AS avg_wall_ms
+            FROM usage WHERE ts >= ? AND session_id IS NOT NULL AND COALESCE(source, 'chat') = 'chat'
+            GROUP BY session_id ORDER BY cost_usd DESC LIMIT ?
+            """,
+            (since, limit),
+        )
+        return [dict(r) for r in rows]
+
+    def cost_by_mode(self, since: float = 0.0) -> List[Dict[str, Any]]:
+        rows = self._query(
+            """
+            SELECT COALESCE(source, 'chat') AS source, mode, COALESCE(submode, '') AS submode,
+                   COUNT(*) AS calls,
+                   SUM(input_tokens) AS input_tokens, SUM(cached_tokens) AS cached_tokens,
+                   SUM(output_tokens) AS output_tokens,
+                   SUM(cost(model, input_tokens, cached_tokens, output_tokens)) AS cost_usd,
+                   AVG(wall_ms) AS avg_wall_ms
+            FROM usage WHERE ts >= ?
+            GROUP BY COALESCE(source, 'chat'), mode, submode ORDER BY cost_usd DESC
+            """,
+            (since,),
+        )
+        return [dict(r) for r in rows]
+
+    def tokens_per_turn(self, bucket_s: int = 3600, since: float = 0.0) -> List[Dict[str, Any]]:
+        rows = self._query(
+            """
+            SELECT CAST(ts / ? AS INTEGER) * ? AS bucket, mode, COUNT(*) AS turns,
+                   AVG(input_tokens) AS avg_input_tokens, AVG(output_tokens) AS avg_output_tokens,
+                   AVG(wall_ms) AS avg_wall_ms
+            FROM usage WHERE ts >= ? AND COALESCE(source, 'chat') = 'chat'
+            GROUP BY bucket, mode ORDER BY bucket, mode
+            """,
+            (bucket_s, bucket_s, since),
+        )
+        return [dict(r) for r in rows]
+
+    def variant_report(self, since: float = 0.0) -> List[Dict[str, Any]]:
+        """依 mode × prompt 變體彙總：延遲、tokens、字數規則遵守率"""
+        rows = self._query(
+            """
+            SELECT mode, COALESCE(variant, 'control') AS variant, COUNT(*) AS calls,
+                   AVG(wall_ms) AS avg_wall_ms,
+                   AVG(input_tokens) AS avg_input_tokens, AVG(output_tokens) AS avg_output_tokens,
+                   AVG(reply_chars) AS avg_reply_chars,
+                   AVG(length_ok) AS length_ok_rate,
+                   SUM(cost(model, input_tokens, cached_tokens, output_tokens)) / COUNT(*) AS cost_per_call_usd
+            FROM usage WHERE ts >= ? AND COALESCE(source, 'chat') = 'chat'
+            GROUP BY mode, COALESCE(variant, 'control') ORDER BY mode, COALESCE(variant, 'control')
+            """,
+            (since,),
+        )
+        return [dict(r) for r in rows]
+
+
+ledger = UsageLedger()
+
+
+# =========================
+# CLI
+# =========================
+def _print_rows(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        print("(no data)")
+        return
+    cols = list(rows[0].keys())
+    print("\t".join(cols))
+    for r in rows:
+        print("\t".join(
+            f"{v:.4f}" if isinstance(v, float) else ("" if v is None else str(v))
+            for v in (r[c] for c in cols)
+        ))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Query the usage ledger")
+    parser.add_argument("--db", default=USAGE_DB_PATH)
+    parser.add_argument("--hours", type=float, default=24 * 7, help="只看最近 N 小時")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_top = sub.add_parser("top-sessions")
+    p_top.add_argument("--limit", type=int, default=10)
+    sub.add_parser("cost-by-mode")
+    p_tpt = sub.add_parser("tokens-over-time")
+    p_tpt.add_argument("--bucket", type=int, default=3600, help="時間分桶（秒）")
+    sub.add_parser("variants")
+    args = parser.parse_args(argv)
+
+    led = UsageLedger(db_path=args.db)
+    since = time.time() - args.hours * 3600
+    if args.cmd == "top-sessions":
+        _print_rows(led.top_sessions(limit=args.limit, since=since))
+    elif args.cmd == "cost-by-mode":
+        _print_rows(led.cost_by_mode(since=since))
+    elif args.cmd == "variants":
+        _print_rows(led.variant_report(since=since))
+    else:
+        rows = led.tokens_per_turn(bucket_s=args.bucket, since=since)
+        for r in rows:
+            r["bucket"] = time.strftime("%Y-%m-%d %H:%M", time.localtime(r["bucket"]))
+        _print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()